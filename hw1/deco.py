@@ -1,6 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import cPickle
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from functools import update_wrapper
 
 
@@ -35,20 +45,303 @@ def countcalls(func):
     return wrapper
 
 
-@decorator
-def memo(func):
+MEMO_ATTRS = frozenset(('cache', 'cache_clear', 'hits', 'misses', 'evictions'))
+KWARGS_MARK = (object(),)
+
+
+def make_key(args, kwargs):
+    '''
+    Cache key of a call: positional-only calls use args tuple as is,
+    keyword arguments are appended after the unique mark in sorted order
+    so f(x, a=1, b=2) and f(x, b=2, a=1) share the same key.
+    '''
+    if not kwargs:
+        return args
+    if len(kwargs) == 1:
+        return args + KWARGS_MARK + tuple(kwargs.items())
+    return args + KWARGS_MARK + tuple(sorted(kwargs.items()))
+
+
+def sync_attrs(wrapper, func):
+    '''
+    Copy attributes of the decorated function changed by its call
+    (e.g. `calls` of countcalls) to the memo wrapper.
+    '''
+    for name, value in getattr(func, '__dict__', {}).iteritems():
+        if name not in MEMO_ATTRS:
+            setattr(wrapper, name, value)
+
+
+def memo(func=None, maxsize=None, ttl=None):
     '''
     Memoize a function so that it caches all return values for
-    faster future lookups.
+    faster future lookups. Cache is unbounded by default, `maxsize`
+    keeps only least recently used results and `ttl` drops results
+    older than given seconds:
+
+    >>> @memo(maxsize=128, ttl=60)
+    ... def f(x):
+    ...     ...
+    >>> f.hits, f.misses, f.evictions
+    >>> f.cache_clear()
+
     '''
+    if func is None:
+        return lambda f: memo(f, maxsize, ttl)
+    if maxsize is None and ttl is None:
+        return _unbounded_memo(func)
+    return _lru_memo(func, maxsize, ttl)
+
+
+def _unbounded_memo(func):
+    cache = {}
+
     def wrapper(*args, **kwargs):
-        update_wrapper(wrapper, func)
-        key = args, frozenset(kwargs.items()) if kwargs else args
-        if key in wrapper.cache:
-            return wrapper.cache[key]
-        res = wrapper.cache[key] = func(*args, **kwargs)
+        key = make_key(args, kwargs) if kwargs else args
+        try:
+            res = cache[key]
+        except KeyError:
+            pass
+        else:
+            wrapper.hits += 1
+            return res
+        wrapper.misses += 1
+        res = cache[key] = func(*args, **kwargs)
+        sync_attrs(wrapper, func)
         return res
-    wrapper.cache = {}
+
+    def cache_clear():
+        cache.clear()
+        wrapper.hits = wrapper.misses = wrapper.evictions = 0
+
+    update_wrapper(wrapper, func)
+    wrapper.cache = cache
+    wrapper.cache_clear = cache_clear
+    wrapper.hits = wrapper.misses = wrapper.evictions = 0
+    return wrapper
+
+
+def _lru_memo(func, maxsize, ttl):
+    # Cache values are links of circular doubly linked list ordered from
+    # the least to the most recently used, so all operations are O(1)
+    PREV, NEXT, KEY, RESULT, EXPIRES = 0, 1, 2, 3, 4
+    cache = {}
+    cache_get = cache.get
+    root = []
+    root[:] = [root, root, None, None, None]
+
+    def unlink(link):
+        link_prev, link_next = link[PREV], link[NEXT]
+        link_prev[NEXT] = link_next
+        link_next[PREV] = link_prev
+
+    def append(link):
+        last = root[PREV]
+        link[PREV], link[NEXT] = last, root
+        last[NEXT] = root[PREV] = link
+
+    def wrapper(*args, **kwargs):
+        key = make_key(args, kwargs) if kwargs else args
+        link = cache_get(key)
+        if link is not None:
+            if ttl is None or link[EXPIRES] > time.time():
+                # move the link to the most recently used end, the last link is read
+                # after unlinking, as it may be the link itself
+                link_prev, link_next = link[PREV], link[NEXT]
+                link_prev[NEXT] = link_next
+                link_next[PREV] = link_prev
+                last = root[PREV]
+                link[PREV], link[NEXT] = last, root
+                last[NEXT] = root[PREV] = link
+                wrapper.hits += 1
+                return link[RESULT]
+            unlink(link)
+            del cache[key]
+            wrapper.evictions += 1
+        wrapper.misses += 1
+        res = func(*args, **kwargs)
+        sync_attrs(wrapper, func)
+        if key in cache:
+            # the same key was cached by recursive call
+            return res
+        if ttl is not None:
+            # links before a link not used since its insertion were used before that, so they expire
+            # earlier too: expired links of keys never requested again are dropped from the head
+            now = time.time()
+            oldest = root[NEXT]
+            while oldest is not root and oldest[EXPIRES] <= now:
+                unlink(oldest)
+                del cache[oldest[KEY]]
+                wrapper.evictions += 1
+                oldest = root[NEXT]
+        if maxsize is not None and len(cache) >= maxsize:
+            oldest = root[NEXT]
+            if oldest is root:
+                return res
+            unlink(oldest)
+            del cache[oldest[KEY]]
+            wrapper.evictions += 1
+        link = [None, None, key, res, time.time() + ttl if ttl is not None else None]
+        append(link)
+        cache[key] = link
+        return res
+
+    def cache_clear():
+        cache.clear()
+        root[:] = [root, root, None, None, None]
+        wrapper.hits = wrapper.misses = wrapper.evictions = 0
+
+    update_wrapper(wrapper, func)
+    wrapper.cache = cache
+    wrapper.cache_clear = cache_clear
+    wrapper.hits = wrapper.misses = wrapper.evictions = 0
+    return wrapper
+
+
+class Flight(object):
+    '''Computation of a cache key other callers of the same key wait for.'''
+    __slots__ = ('done', 'result', 'exc_info')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+    def run(self, func, *args, **kwargs):
+        try:
+            self.result = func(*args, **kwargs)
+        except BaseException:
+            # SystemExit and the like stop the leader, waiters must not take None as result
+            self.exc_info = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def get(self):
+        self.done.wait()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+class DiskStore(object):
+    '''
+    Results store shared by processes: each result is pickled into its own
+    file named by digest of the key, so keys and results have to be picklable.
+    Computations of the same key are serialized by lock file. Directory on
+    tmpfs (e.g. /dev/shm) keeps the store in shared memory.
+    '''
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def get_path(self, key):
+        return os.path.join(self.path, hashlib.md5(cPickle.dumps(key, cPickle.HIGHEST_PROTOCOL)).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                if self.ttl is not None and time.time() - os.fstat(f.fileno()).st_mtime > self.ttl:
+                    raise KeyError(key)
+                return cPickle.load(f)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                raise KeyError(key)
+            raise
+
+    def set(self, key, value):
+        path = self.get_path(key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+    @contextmanager
+    def lock(self, key):
+        with open(self.get_path(key) + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+
+
+def sync_memo(func=None, maxsize=None, ttl=None, store=None):
+    '''
+    Thread-safe memo: concurrent calls with the same arguments wait for
+    a single computation instead of computing the same value several times.
+    Optional `store` shares results between processes:
+
+    >>> @sync_memo(maxsize=1024, store=DiskStore('/dev/shm/rates'))
+    ... def get_rate(currency):
+    ...     ...
+
+    '''
+    if func is None:
+        return lambda f: sync_memo(f, maxsize, ttl, store)
+    lock = threading.Lock()
+    flights = {}
+
+    def compute(*args, **kwargs):
+        # Called by the cache on miss while the lock is held. The lock is
+        # released for the computation, so other keys are served meanwhile,
+        # and callers of the same key join the running flight.
+        key = make_key(args, kwargs) if kwargs else args
+        flight = flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = flights[key] = Flight()
+        lock.release()
+        try:
+            if leader:
+                flight.run(load if store is not None else func, *args, **kwargs)
+            return flight.get()
+        finally:
+            lock.acquire()
+            if leader:
+                del flights[key]
+                sync_attrs(wrapper, func)
+
+    def load(*args, **kwargs):
+        store_key = func.__module__, func.__name__, args, tuple(sorted(kwargs.items()))
+        with store.lock(store_key):
+            try:
+                return store.get(store_key)
+            except KeyError:
+                res = func(*args, **kwargs)
+                store.set(store_key, res)
+                return res
+
+    cached = memo(compute, maxsize, ttl)
+
+    def sync_stats():
+        wrapper.hits, wrapper.misses, wrapper.evictions = cached.hits, cached.misses, cached.evictions
+
+    def wrapper(*args, **kwargs):
+        with lock:
+            try:
+                return cached(*args, **kwargs)
+            finally:
+                sync_stats()
+
+    def cache_clear():
+        with lock:
+            cached.cache_clear()
+            sync_stats()
+
+    update_wrapper(wrapper, func)
+    wrapper.cache = cached.cache
+    wrapper.cache_clear = cache_clear
+    sync_stats()
     return wrapper
 
 
@@ -59,7 +352,21 @@ def n_ary(func):
     that f(x, y, z) = f(x, f(y,z)), etc. Also allow f(x) = x.
     '''
     def wrapper(x, *args):
-        return x if not args else func(x, wrapper(*args))
+        if not args:
+            return x
+        res = args[-1]
+        for i in xrange(len(args) - 2, -1, -1):
+            res = func(args[i], res)
+        return func(x, res)
+
+    def fold(iterable):
+        '''f.fold(iterable) == f(*iterable), e.g. for arguments of a generator.'''
+        args = iterable if isinstance(iterable, (tuple, list)) else tuple(iterable)
+        if not args:
+            raise TypeError('%s.fold() of empty iterable' % func.__name__)
+        return wrapper(*args)
+
+    wrapper.fold = fold
     return wrapper
 
 
@@ -94,6 +401,146 @@ def trace(line):
         return wrapper
     return tracer
 
+
+class FuncProfile(object):
+    '''
+    Profile of a function: all calls are counted, sampled calls are timed.
+    Self time excludes time of nested sampled calls of profiled functions.
+    Histogram counts sampled calls by latency buckets: bucket `i` holds
+    latencies in [2 ** (i - 1), 2 ** i) microseconds.
+    '''
+    __slots__ = ('name', 'calls', 'sampled', 'total_time', 'self_time', 'max_time', 'histogram')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.sampled = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * 64
+
+    def add(self, elapsed, child_time):
+        self.sampled += 1
+        self.total_time += elapsed
+        self.self_time += elapsed - child_time
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        self.histogram[min(int(elapsed * 1e6).bit_length(), 63)] += 1
+
+    def to_dict(self):
+        scale = float(self.calls) / self.sampled if self.sampled else 0
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'sampled': self.sampled,
+            'total_time': self.total_time * scale,
+            'self_time': self.self_time * scale,
+            'avg_time': self.total_time / self.sampled if self.sampled else 0,
+            'max_time': self.max_time,
+            'histogram': dict((2 ** i, count) for i, count in enumerate(self.histogram) if count),
+        }
+
+
+class Profiler(object):
+    '''
+    Registry of function profiles. Disabled profiler costs a flag check per
+    call, `profile = disable` removes profiling completely. `rate` is a share
+    of timed calls, e.g. 0.01 times every 100th call of each function and
+    totals are extrapolated by call count.
+    '''
+
+    def __init__(self, rate=1.0, enabled=True):
+        self.enabled = enabled
+        self.rate = rate
+        self.profiles = {}
+        self.local = threading.local()
+
+    def get_profile(self, name):
+        if name not in self.profiles:
+            self.profiles[name] = FuncProfile(name)
+        return self.profiles[name]
+
+    def get_stack(self):
+        # child time accumulators of the sampled calls in progress
+        try:
+            return self.local.stack
+        except AttributeError:
+            stack = self.local.stack = []
+            return stack
+
+    def reset(self):
+        self.profiles.clear()
+
+    def export(self, sort='total_time'):
+        return sorted((p.to_dict() for p in self.profiles.values()), key=lambda p: p[sort], reverse=True)
+
+    def save(self, path, sort='total_time'):
+        with open(path, 'w') as f:
+            json.dump(self.export(sort), f, indent=2)
+
+    def dump(self, stream=None, sort='total_time', limit=None):
+        stream = stream or sys.stdout
+        stream.write('%10s %10s %12s %12s %12s %12s  %s\n' % ('calls', 'sampled', 'total, s', 'self, s',
+                                                                'avg, ms', 'max, ms', 'function'))
+        for p in self.export(sort)[:limit]:
+            stream.write('%10d %10d %12.6f %12.6f %12.6f %12.6f  %s\n' % (
+                p['calls'], p['sampled'], p['total_time'], p['self_time'], p['avg_time'] * 1000,
+                p['max_time'] * 1000, p['name']))
+
+
+PROFILER = Profiler()
+
+
+def profile(func=None, name=None, rate=None, profiler=None):
+    '''
+    Record call count, cumulative and self time and latency histogram of
+    the function decorated into profiler registry (PROFILER by default):
+
+    >>> @profile(rate=0.1)
+    ... def parse_line(line):
+    ...     ...
+    >>> PROFILER.dump()
+
+    '''
+    if func is None:
+        return lambda f: profile(f, name, rate, profiler)
+    profiler = profiler or PROFILER
+    func_profile = profiler.get_profile(name or '%s.%s' % (func.__module__, func.__name__))
+    rate = profiler.rate if rate is None else rate
+    interval = max(int(round(1 / rate)), 1) if rate else 0
+
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled:
+            return func(*args, **kwargs)
+        func_profile.calls += 1
+        if not interval or func_profile.calls % interval:
+            return func(*args, **kwargs)
+        stack = profiler.get_stack()
+        stack.append(0.0)
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            func_profile.add(elapsed, stack.pop())
+            if stack:
+                stack[-1] += elapsed
+    return update_wrapper(wrapper, func)
+
+
+def profile_names(namespace, names, **kwargs):
+    '''
+    Profile functions of a module or class in place, e.g. hot functions
+    of log analyzer without changes of its code:
+
+    >>> profile_names(log_analyzer, ['parse_line_regex', 'collect_stat'], rate=0.01)
+
+    '''
+    for name in names:
+        setattr(namespace, name, profile(getattr(namespace, name), **kwargs))
+
+
 # tests disable
 # memo = disable
 
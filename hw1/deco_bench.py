@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Micro-benchmarks of deco decorators.
+#
+# memo    - cache hit latency of memo against its previous implementation and functools-style caching
+# profile - call overhead of profile decorator: disabled, sampled and timing every call
+# n_ary   - n_ary call with thousands of arguments against its previous recursive implementation
+#
+# $ python deco_bench.py memo -n 1000000
+
+import argparse
+import timeit
+from functools import update_wrapper
+
+import deco
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Deco Benchmark.')
+    parser.add_argument('bench', help='benchmark to run (default: memo)', nargs='?', choices=sorted(BENCHES),
+                        default='memo')
+    parser.add_argument('-n', '--number', help='count of calls per case (default: 1000000)',
+                        type=int, default=1000000)
+    parser.add_argument('-r', '--repeat', help='repeats of each case, the best one is taken (default: 3)',
+                        type=int, default=3)
+    return parser.parse_args()
+
+
+def memo_legacy(func):
+    """memo as it was before: metadata copying and frozenset key on each call"""
+    def wrapper(*args, **kwargs):
+        update_wrapper(wrapper, func)
+        key = args, frozenset(kwargs.items()) if kwargs else args
+        if key in wrapper.cache:
+            return wrapper.cache[key]
+        res = wrapper.cache[key] = func(*args, **kwargs)
+        return res
+    wrapper.cache = {}
+    return update_wrapper(wrapper, func)
+
+
+def memo_functools(func):
+    """Unbounded cache the way functools.lru_cache(maxsize=None) of Python 3 does it"""
+    cache = {}
+    cache_get = cache.get
+    sentinel = object()
+    kwd_mark = (object(),)
+
+    def wrapper(*args, **kwargs):
+        key = args
+        if kwargs:
+            key += kwd_mark
+            for item in kwargs.items():
+                key += item
+        result = cache_get(key, sentinel)
+        if result is not sentinel:
+            return result
+        result = cache[key] = func(*args, **kwargs)
+        return result
+    return update_wrapper(wrapper, func)
+
+
+MEMOS = (
+    ('legacy', memo_legacy),
+    ('functools', memo_functools),
+    ('memo', deco.memo),
+    ('memo lru', deco.memo(maxsize=128)),
+    ('memo ttl', deco.memo(maxsize=128, ttl=3600)),
+)
+
+CALLS = (
+    ('f(1, 2)', (1, 2), {}),
+    ('f(1, b=2)', (1,), {'b': 2}),
+    ('f(a=1, b=2)', (), {'a': 1, 'b': 2}),
+)
+
+
+def n_ary_legacy(func):
+    """n_ary as it was before: recursion with re-packing of the tail arguments"""
+    def wrapper(x, *args):
+        return x if not args else func(x, wrapper(*args))
+    return update_wrapper(wrapper, func)
+
+
+def add(a, b):
+    return a + b
+
+
+def bench_memo(number, repeat):
+    print 'Cache hit latency, ns per call (best of %d x %d calls):' % (repeat, number)
+    print '%-12s' % 'memo' + ''.join('%14s' % name for name, _, _ in CALLS)
+    base = None
+    for name, memo in MEMOS:
+        f = memo(add)
+        latencies = []
+        for _, args, kwargs in CALLS:
+            f(*args, **kwargs)
+            best = min(timeit.repeat(lambda: f(*args, **kwargs), number=number, repeat=repeat))
+            latencies.append(best / number * 1e9)
+        base = base or latencies
+        print '%-12s' % name + ''.join('%8.0f (x%.1f)' % (latency, base_latency / latency)
+                                        for latency, base_latency in zip(latencies, base))
+
+
+def bench_profile(number, repeat):
+    print 'Call overhead, ns per call (best of %d x %d calls):' % (repeat, number)
+    base = min(timeit.repeat(lambda: add(1, 2), number=number, repeat=repeat))
+    print '%-16s %8.0f' % ('plain', base / number * 1e9)
+    for name, enabled, rate in (('disabled', False, 1.0), ('rate 0.01', True, 0.01), ('rate 1', True, 1.0)):
+        profiler = deco.Profiler(rate, enabled)
+        f = deco.profile(add, profiler=profiler)
+        best = min(timeit.repeat(lambda: f(1, 2), number=number, repeat=repeat))
+        print '%-16s %8.0f (+%.0f)' % (name, best / number * 1e9, (best - base) / number * 1e9)
+
+
+def bench_n_ary(number, repeat):
+    number = max(number // 10000, 1)
+    print 'n_ary call, ms per call (best of %d x %d calls):' % (repeat, number)
+    legacy, iterative = n_ary_legacy(add), deco.n_ary(add)
+    for count in (10, 100, 300, 1000, 10000, 100000):
+        args = range(count)
+        best = min(timeit.repeat(lambda: iterative(*args), number=number, repeat=repeat)) / number
+        try:
+            legacy_best = min(timeit.repeat(lambda: legacy(*args), number=number, repeat=repeat)) / number
+        except RuntimeError:
+            print '%6d args: %10.3f, recursive exceeds recursion limit' % (count, best * 1000)
+        else:
+            print '%6d args: %10.3f, recursive %10.3f (x%.1f)' % (count, best * 1000, legacy_best * 1000,
+                                                                  legacy_best / best)
+
+
+BENCHES = {
+    'memo': bench_memo,
+    'profile': bench_profile,
+    'n_ary': bench_n_ary,
+}
+
+
+def main():
+    args = parse_args()
+    BENCHES[args.bench](args.number, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Texas hold'em equity of known hole cards on a partial board. Remaining boards
+# are enumerated exhaustively when there are few of them, otherwise sampled by
+# Monte Carlo; both are split into chunks handled by a process pool:
+#
+# $ python equity.py "AS KS" "QH QD" --board "2S 7S 9D"
+# $ python equity.py "AS KS" --opponents 2 -n 1000000 -w 4
+
+import argparse
+import itertools
+import math
+import multiprocessing
+import random
+import time
+
+import poker
+
+EXACT_LIMIT = 200000
+DEFAULT_TRIALS = 100000
+CHUNK_TRIALS = 20000
+CONFIDENCE_Z = {0.9: 1.645, 0.95: 1.96, 0.99: 2.576}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Texas Hold'em Equity Calculator.")
+    parser.add_argument('players', help='hole cards of players, e.g. "AS KS"', nargs='+')
+    parser.add_argument('-b', '--board', help='known board cards, e.g. "2S 7S 9D"', default='')
+    parser.add_argument('-o', '--opponents', help='count of opponents with random hole cards', type=int, default=0)
+    parser.add_argument('-n', '--trials', help='count of Monte Carlo trials (default: exhaustive if boards '
+                                               'are fewer than %d, else %d)' % (EXACT_LIMIT, DEFAULT_TRIALS), type=int)
+    parser.add_argument('-w', '--workers', help='count of worker processes (default: 1)', type=int, default=1)
+    parser.add_argument('-c', '--confidence', help='confidence level (default: 0.95)', type=float,
+                        choices=sorted(CONFIDENCE_Z), default=0.95)
+    parser.add_argument('--seed', help='random seed', type=int)
+    return parser.parse_args()
+
+
+class Stat(object):
+    """Sums of equity shares of players over trials, a tie splits the pot between winners"""
+
+    def __init__(self, players):
+        self.trials = 0
+        self.wins = [0] * players
+        self.ties = [0] * players
+        self.shares = [0.0] * players
+        self.squares = [0.0] * players
+
+    def add(self, values):
+        best = max(values)
+        winners = [i for i, value in enumerate(values) if value == best]
+        share = 1.0 / len(winners)
+        self.trials += 1
+        for i in winners:
+            if len(winners) == 1:
+                self.wins[i] += 1
+            else:
+                self.ties[i] += 1
+            self.shares[i] += share
+            self.squares[i] += share * share
+
+    def merge(self, other):
+        self.trials += other.trials
+        for i in range(len(self.shares)):
+            self.wins[i] += other.wins[i]
+            self.ties[i] += other.ties[i]
+            self.shares[i] += other.shares[i]
+            self.squares[i] += other.squares[i]
+
+    def get_equity(self, i, z=None):
+        """Equity of the player with `z` standard errors confidence interval (None for exhaustive enumeration)"""
+        mean = self.shares[i] / self.trials
+        margin = 0.0
+        if z is not None and self.trials > 1:
+            variance = max(self.squares[i] / self.trials - mean * mean, 0) * self.trials / (self.trials - 1)
+            margin = z * math.sqrt(variance / self.trials)
+        return mean, max(mean - margin, 0.0), min(mean + margin, 1.0)
+
+
+def get_deck(dead):
+    dead = set(dead)
+    return [code for card, code in sorted(poker.CARD_CODES.items()) if code not in dead]
+
+
+def enumerate_chunk((players, board, deck, first)):
+    """Boards completed by deck[first] and combinations of the cards after it"""
+    evaluate_best = poker.evaluate_best
+    stat = Stat(len(players))
+    missing = 5 - len(board)
+    for rest in itertools.combinations(deck[first + 1:], missing - 1):
+        full_board = board + [deck[first]] + list(rest)
+        stat.add([evaluate_best(hole + full_board)[0] for hole in players])
+    return stat
+
+
+def simulate_chunk((players, board, deck, opponents, trials, seed)):
+    """Random boards and hole cards of opponents"""
+    evaluate_best = poker.evaluate_best
+    rnd = random.Random(seed)
+    stat = Stat(len(players) + opponents)
+    missing = 5 - len(board)
+    for _ in xrange(trials):
+        cards = rnd.sample(deck, missing + 2 * opponents)
+        full_board = board + cards[:missing]
+        holes = players + [cards[i:i + 2] for i in xrange(missing, len(cards), 2)]
+        stat.add([evaluate_best(hole + full_board)[0] for hole in holes])
+    return stat
+
+
+def count_boards(deck, board):
+    missing = 5 - len(board)
+    return math.factorial(len(deck)) // math.factorial(missing) // math.factorial(len(deck) - missing)
+
+
+def get_tasks(players, board, deck, opponents, trials, seed):
+    """Chunks of exhaustive enumeration if trials is None, else of Monte Carlo simulation"""
+    if trials is None:
+        return enumerate_chunk, [(players, board, deck, first) for first in range(len(deck) - 4 + len(board))]
+    rnd = random.Random(seed)
+    chunks = [CHUNK_TRIALS] * (trials // CHUNK_TRIALS) + ([trials % CHUNK_TRIALS] if trials % CHUNK_TRIALS else [])
+    return simulate_chunk, [(players, board, deck, opponents, size, rnd.getrandbits(32)) for size in chunks]
+
+
+def calculate(players, board=(), opponents=0, trials=None, workers=1, seed=None):
+    """
+    Equity stat of players given by lists of card names against each other and
+    `opponents` with random hole cards. Boards are enumerated exhaustively when
+    trials is None and there are at most EXACT_LIMIT of them, else `trials`
+    (DEFAULT_TRIALS) random boards are sampled. Returns stat and whether it is exact.
+    """
+    try:
+        players = [[poker.CARD_CODES[card] for card in hole] for hole in players]
+        board = [poker.CARD_CODES[card] for card in board]
+    except KeyError as e:
+        raise ValueError('Unexpected card %s' % e)
+    if len(board) > 5 or any(len(hole) != 2 for hole in players) or len(players) + opponents < 2:
+        raise ValueError('Expected 2 hole cards of each of 2+ players and up to 5 board cards')
+    known = sum(players, board)
+    if len(set(known)) < len(known):
+        raise ValueError('Duplicate cards')
+    poker.get_tables()
+    if len(board) == 5 and not opponents:
+        stat = Stat(len(players))
+        stat.add([poker.evaluate_best(hole + board)[0] for hole in players])
+        return stat, True
+
+    deck = get_deck(known)
+    exact = trials is None and not opponents and count_boards(deck, board) <= EXACT_LIMIT
+    handle, tasks = get_tasks(players, board, deck, opponents, None if exact else trials or DEFAULT_TRIALS, seed)
+    stat = Stat(len(players) + opponents)
+    if workers > 1:
+        # tables are built before fork, so workers share them
+        pool = multiprocessing.Pool(workers)
+        try:
+            for chunk_stat in pool.imap_unordered(handle, tasks):
+                stat.merge(chunk_stat)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            stat.merge(handle(task))
+    return stat, exact
+
+
+def main():
+    args = parse_args()
+    players = [hole.split() for hole in args.players]
+    board = args.board.split()
+    poker.get_tables()
+    started = time.time()
+    stat, exact = calculate(players, board, args.opponents, args.trials, args.workers, args.seed)
+    elapsed = time.time() - started
+    z = None if exact else CONFIDENCE_Z[args.confidence]
+    names = [' '.join(hole) for hole in players] + ['random #%d' % (i + 1) for i in range(args.opponents)]
+    print '%s %d boards%s' % ('Exhaustive' if exact else 'Monte Carlo', stat.trials,
+                              ' on ' + ' '.join(board) if board else '')
+    for i, name in enumerate(names):
+        equity, low, high = stat.get_equity(i, z)
+        interval = '' if exact else ' (%.1f%% CI %.2f%% - %.2f%%)' % (args.confidence * 100, low * 100, high * 100)
+        print '%-12s equity %6.2f%%%s, win %6.2f%%, tie %6.2f%%' % (
+            name, equity * 100, interval, 100.0 * stat.wins[i] / stat.trials, 100.0 * stat.ties[i] / stat.trials)
+    print '%.3f s, %d boards/s, %d hands/s' % (elapsed, stat.trials / elapsed, stat.trials * len(names) / elapsed)
+
+
+if __name__ == '__main__':
+    main()
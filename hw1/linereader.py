@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Line readers of plain and gzip files with pluggable decompression backend.
+# Block backends read and decompress data by big blocks and split lines from
+# buffers, so lines are yielded without trailing line terminator:
+#
+# >>> for line in read_lines('nginx-access-ui.log-20170630.gz', backend='thread'):
+# ...     parse_line(line)
+
+import Queue
+import gzip
+import subprocess
+import threading
+import zlib
+
+BLOCK_SIZE = 1024 * 1024
+QUEUE_SIZE = 4
+ZCAT_COMMAND = ('zcat',)  # ('pigz', '-dc') for parallel decompression
+SENTINEL = object()
+
+
+def iter_file_blocks(path, block_size=BLOCK_SIZE):
+    with open(path, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            yield block
+            block = f.read(block_size)
+
+
+def iter_zlib_blocks(path, block_size=BLOCK_SIZE):
+    """Decompress gzip file by blocks, concatenated gzip members are supported"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for block in iter_file_blocks(path, block_size):
+        while block:
+            data = decompressor.decompress(block)
+            if data:
+                yield data
+            block = decompressor.unused_data
+            if block:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def iter_thread_blocks(path, block_size=BLOCK_SIZE, queue_size=QUEUE_SIZE):
+    """Read and decompress blocks in background thread while the caller handles the previous ones"""
+    queue = Queue.Queue(queue_size)
+    stopped = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                continue
+
+    def produce():
+        try:
+            for block in iter_blocks(path, block_size):
+                put(block)
+                if stopped.is_set():
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(SENTINEL)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        block = queue.get()
+        while block is not SENTINEL:
+            yield block
+            block = queue.get()
+    finally:
+        stopped.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
+def iter_zcat_blocks(path, block_size=BLOCK_SIZE, command=ZCAT_COMMAND):
+    """Decompress gzip file in external process, e.g. `zcat` or `pigz -dc`"""
+    process = subprocess.Popen(list(command) + [path], stdout=subprocess.PIPE, bufsize=block_size)
+    try:
+        block = process.stdout.read(block_size)
+        while block:
+            yield block
+            block = process.stdout.read(block_size)
+    except GeneratorExit:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+        raise
+    process.stdout.close()
+    if process.wait():
+        raise IOError('`%s` exited with code %d' % (' '.join(command), process.returncode))
+
+
+def iter_blocks(path, block_size=BLOCK_SIZE):
+    if path.endswith('.gz'):
+        return iter_zlib_blocks(path, block_size)
+    return iter_file_blocks(path, block_size)
+
+
+def split_lines(blocks):
+    """Split lines by `\\n` from the stream of data blocks"""
+    tail = ''
+    for block in blocks:
+        lines = block.split('\n')
+        lines[0] = tail + lines[0]
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+
+def read_gzip_lines(path, block_size=BLOCK_SIZE):
+    """Line by line reading with gzip module, lines keep trailing line terminator"""
+    log = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    try:
+        for line in log:
+            yield line
+    finally:
+        log.close()
+
+
+def read_zlib_lines(path, block_size=BLOCK_SIZE):
+    return split_lines(iter_blocks(path, block_size))
+
+
+def read_thread_lines(path, block_size=BLOCK_SIZE):
+    return split_lines(iter_thread_blocks(path, block_size))
+
+
+def read_zcat_lines(path, block_size=BLOCK_SIZE):
+    if path.endswith('.gz'):
+        return split_lines(iter_zcat_blocks(path, block_size))
+    return split_lines(iter_file_blocks(path, block_size))
+
+
+BACKENDS = {
+    'gzip': read_gzip_lines,
+    'zlib': read_zlib_lines,
+    'thread': read_thread_lines,
+    'zcat': read_zcat_lines,
+}
+
+
+def read_lines(path, backend='gzip', block_size=BLOCK_SIZE):
+    if backend not in BACKENDS:
+        raise RuntimeError('Unexpected reader backend `%s`' % backend)
+    return BACKENDS[backend](path, block_size)
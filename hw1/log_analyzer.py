@@ -9,6 +9,13 @@
 
 import collections
 import argparse
+import cPickle
+import hashlib
+import heapq
+import bisect
+import functools
+import itertools
+import multiprocessing
 import gzip
 import glob
 import json
@@ -17,14 +24,41 @@ import sys
 import os
 import re
 
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import linereader
 
 CONFIG = {
     "REPORT_SIZE": 1000,
     "REPORT_DIR": "./reports",
-    "LOG_DIR": "./log"
+    "LOG_DIR": "./log",
+    "WORKERS": 1,
+    "CHUNK_BYTES": 32 * 1024 * 1024,
+    "CHUNK_LINES": 100000,
+    "SKETCH_ACCURACY": None,
+    "PERCENTILES": (50, 95, 99),
+    "PARSER": "regex",
+    "STATE_DIR": "./state",
+    "READER": "gzip",
+    "CACHE_DIR": "./cache",
+    "TOP_CAPACITY": None,
+    "NORMALIZE": False,
+    "NORMALIZE_RULES": (
+        (r'\d+', '{id}'),
+        (r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}', '{uuid}'),
+        (r'[0-9a-fA-F]{16,}', '{hash}'),
+    ),
+    "NORMALIZE_CACHE_SIZE": 100000,
+    "REPORT_LAYOUT": "rows",
+    "BUCKET_MINUTES": None,
+    "BUCKET_TOP_URLS": 20,
+    "BUCKET_ACCURACY": 0.05
 }
 
+# Expands columnar table in html report into the rows expected by the report template
+COLUMNS_TO_ROWS_JS = ('(function (t) { return t.rows.map(function (r) { var o = {}; '
+                      'for (var i = 0; i < t.columns.length; i++) { o[t.columns[i]] = r[i]; } return o; }); })')
+
 PATS = (r''
         r'^\S+\s\S+\s{2}\S+\s\[.*?\]\s'
         r'\"\S+\s(\S+)\s\S+\"\s'  # request_url
@@ -39,47 +73,160 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Nginx Log Analyzer Tool.')
     parser.add_argument('-l', '--log_path', help='path to log file')
     parser.add_argument('-j', '--json', help='save log analyze as raw json file (default: html)', action='store_true')
-    return parser.parse_args()
-
-
-def get_report(log_stat, total_count, total_time, limit=100):
+    parser.add_argument('-w', '--workers', help='count of parsing processes (default: %d)' % CONFIG['WORKERS'],
+                        type=int, default=CONFIG['WORKERS'])
+    parser.add_argument('-s', '--sketch', help='aggregate request times into quantile sketches with given relative '
+                                               'accuracy, e.g. 0.01 (default: keep every request time)',
+                        type=parse_accuracy, default=CONFIG['SKETCH_ACCURACY'])
+    parser.add_argument('-p', '--parser', help='log line parser engine (default: %s)' % CONFIG['PARSER'],
+                        choices=sorted(PARSERS), default=CONFIG['PARSER'])
+    parser.add_argument('-i', '--incremental', help='read only lines appended since the previous run and '
+                                                    'rebuild report from the saved state (single process with '
+                                                    'the builtin reader, so not combined with --workers and '
+                                                    '--reader). Lines of .gz logs read before are not parsed '
+                                                    'again, but they are still decompressed on every run',
+                        action='store_true')
+    parser.add_argument('-r', '--reader', help='log reading and decompression backend (default: %s)' % CONFIG['READER'],
+                        choices=sorted(linereader.BACKENDS), default=CONFIG['READER'])
+    parser.add_argument('--date_from', help='build one report for all logs from date (YYYYMMDD) into `LOG_DIR`',
+                        type=parse_date)
+    parser.add_argument('--date_to', help='build one report for all logs till date (YYYYMMDD) into `LOG_DIR`',
+                        type=parse_date)
+    parser.add_argument('-g', '--glob', help='build one report for all logs matched by the pattern')
+    parser.add_argument('-t', '--top_capacity', help='keep only the heaviest urls by time sum while reading, so '
+                                                     'memory is bounded but stats of the rare urls are approximate '
+                                                     '(should be several times bigger than `REPORT_SIZE`)',
+                        type=int, default=CONFIG['TOP_CAPACITY'])
+    parser.add_argument('-b', '--bucket_minutes', help='also save latency series of top urls per time bucket of '
+                                                       'given minutes into `<report>.series.json`', type=int,
+                        default=CONFIG['BUCKET_MINUTES'])
+    parser.add_argument('-c', '--columnar', help='save report table as columns list and rows of values '
+                                                 'instead of list of objects', action='store_true')
+    parser.add_argument('-n', '--normalize', help='strip query string and replace ids in url path by templates '
+                                                  'from `NORMALIZE_RULES`', action='store_true')
+    args = parser.parse_args()
+    if args.incremental and (args.workers > 1 or args.reader != CONFIG['READER']):
+        parser.error('--incremental reads the log in a single process with the builtin reader, '
+                     'it can not be combined with --workers and --reader')
+    return args
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y%m%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('Date `%s` is not in YYYYMMDD format' % value)
+
+
+def parse_accuracy(value):
+    try:
+        accuracy = float(value)
+    except ValueError:
+        accuracy = None
+    if accuracy is None or not 0 < accuracy < 1:
+        raise argparse.ArgumentTypeError('Accuracy `%s` is not a number between 0 and 1' % value)
+    return accuracy
+
+
+def get_report(log_stat, total_count, total_time, limit=100, percentiles=None):
     report_data = []
     one_count_percent = float(total_count / 100)
     one_time_percent = float(total_time / 100)
-
-    for url, times in log_stat.items():
-        count = len(times)
-        time_sum = sum(times)
-        report_data.append({
+    percentiles = percentiles or CONFIG['PERCENTILES']
+    percentile_keys = ['time_p%s' % p for p in percentiles]
+
+    # Report order depends only on the time sum, so full stats are computed for top urls only
+    top_urls = heapq.nlargest(limit, ((url, get_times_sum(times)) for url, times in log_stat.iteritems()),
+                              key=lambda x: (round_f(x[1] / one_time_percent), round_f(x[1]), x[0]))
+    for url, _ in top_urls:
+        count, time_sum, time_max, values = get_times_summary(log_stat[url], percentiles)
+        row = {
             'url': url,
-            'time_max': max(times),
+            'time_max': time_max,
             'count': count,
             'time_sum': round_f(time_sum),
             'count_perc': round_f(count / one_count_percent),
             'time_perc': round_f(time_sum / one_time_percent),
-            'time_p50': round_f(percentile(times, 50)),
-            'time_p95': round_f(percentile(times, 95)),
-            'time_p99': round_f(percentile(times, 99))
-            })
-    report_data.sort(key=lambda x: (x['time_perc'], x['time_sum']), reverse=True)
+        }
+        for key, value in zip(percentile_keys, values):
+            row[key] = round_f(value)
+        report_data.append(row)
 
-    return report_data[:limit]
+    return report_data
 
 
-def save_report(report, file_path):
+def get_series_report(series, limit=20, percentiles=None):
+    """Stats of top urls by time sum for every time bucket, buckets are ordered by time"""
+    percentiles = percentiles or CONFIG['PERCENTILES']
+    percentile_keys = ['time_p%s' % p for p in percentiles]
+    report_data = []
+    for bucket in sorted(series):
+        rows = []
+        for url, times in heapq.nlargest(limit, series[bucket].iteritems(), key=lambda x: (x[1].sum, x[0])):
+            count, time_sum, time_max, values = get_times_summary(times, percentiles)
+            row = {
+                'url': url,
+                'time_max': time_max,
+                'count': count,
+                'time_sum': round_f(time_sum),
+            }
+            for key, value in zip(percentile_keys, values):
+                row[key] = round_f(value)
+            rows.append(row)
+        report_data.append({'bucket': bucket, 'urls': rows})
+    return report_data
+
+
+def get_series_path(report_path):
+    return os.path.splitext(report_path)[0] + '.series.json'
+
+
+def save_report(report, file_path, layout=None):
+    """Stream report rows into the file one by one, without building the whole json string in memory"""
+    layout = layout or CONFIG['REPORT_LAYOUT']
     if file_path.endswith('.html'):
         with open('./report.html', 'r') as f:
-            file_data = f.read()
-        file_data = file_data.replace('$table_json', json.dumps(report))
+            prefix, _, suffix = f.read().partition('$table_json')
         with open(file_path, 'w') as f:
-            f.write(file_data)
+            f.write(prefix)
+            if layout == 'columns':
+                f.write(COLUMNS_TO_ROWS_JS + '(')
+                write_report_json(f, report, layout)
+                f.write(')')
+            else:
+                write_report_json(f, report, layout)
+            f.write(suffix)
     elif file_path.endswith('.json'):
         with open(file_path, 'w') as f:
-            json.dump(report, f)
+            write_report_json(f, report, layout)
     else:
         raise RuntimeError('Unexpected report file format')
 
 
+def write_report_json(f, report, layout='rows'):
+    """
+    Write report as json list of row objects (same as `json.dump`) or, for `columns` layout,
+    as {"columns": [<names>], "rows": [[<values>], ...]} which does not repeat keys in every row
+    """
+    encode = json.JSONEncoder().encode
+    rows = iter(report)
+    if layout == 'columns':
+        first_row = next(rows, None)
+        columns = sorted(first_row) if first_row is not None else []
+        if first_row is not None:
+            rows = itertools.chain([first_row], rows)
+        rows = ([row[column] for column in columns] for row in rows)
+        f.write('{"columns": %s, "rows": ' % encode(columns))
+    f.write('[')
+    for i, row in enumerate(rows):
+        if i:
+            f.write(', ')
+        f.write(encode(row))
+    f.write(']')
+    if layout == 'columns':
+        f.write('}')
+
+
 def get_latest_file(file_dir):
     files = glob.glob(file_dir + '/nginx-access-ui.log-*')
     if files:
@@ -92,14 +239,33 @@ def get_file_date(file_path):
     file_date = re.match(r'^.*-(\d+)\.?\w*$', file_path)
     if file_date:
         return datetime.strptime(file_date.group(1), '%Y%m%d')
-    raise RuntimeError('Unexpected log file format')
+    raise RuntimeError('Unexpected log file format `%s`' % file_path)
+
+
+def get_times_sum(times):
+    if isinstance(times, TimeSketch):
+        return times.sum
+    return sum(times)
+
+
+def get_times_summary(times, percentiles):
+    """Return count, sum, max and the given percentiles of url request times in one sort"""
+    if isinstance(times, TimeSketch):
+        return times.count, times.sum, times.max, times.percentiles(percentiles)
+    sorted_times = sorted(times)
+    return len(times), sum(times), sorted_times[-1], [sorted_percentile(sorted_times, p) for p in percentiles]
 
 
 def percentile(lst, p):
-    lst = sorted(lst)
+    return sorted_percentile(sorted(lst), p)
+
+
+def sorted_percentile(lst, p):
+    """Percentile of already sorted list"""
     index = (p / 100.0) * len(lst)
     if math.floor(index) == index:
-        result = (lst[int(index)-1] + lst[int(index)]) / 2.0
+        index = int(index)
+        result = (lst[max(index - 1, 0)] + lst[min(index, len(lst) - 1)]) / 2.0
     else:
         result = lst[int(math.floor(index))]
     return result
@@ -122,45 +288,570 @@ def round_f(number):
 
 
 def parse_line(line):
+    parsed_line = parse_line_regex(line)
+    if parsed_line:
+        return dict(zip(('request_url', 'request_time'), parsed_line))
+    return None
+
+
+def parse_line_regex(line):
+    """Return (request_url, request_time) tuple or None"""
     g = PAT.match(line)
     if g:
-        col_names = ('request_url', 'request_time')
-        parsed_line = (dict(zip(col_names, g.groups())))
-        parsed_line['request_time'] = float(parsed_line['request_time']) if parsed_line['request_time'] != '-' else 0
-        return parsed_line
+        request_url, request_time = g.groups()
+        return request_url, float(request_time) if request_time != '-' else 0
     return None
 
 
-def xreadlines(log_path):
-    if log_path.endswith('.gz'):
-        log = gzip.open(log_path, 'rb')
-    else:
-        log = open(log_path)
-    for line in log:
+def parse_line_fast(line):
+    """
+    Positional parser of `ui_short` line: request url is the middle word of the first quoted field
+    and request time is the single word after the last quoted field. Lines which are not split into
+    the quoted fields of `ui_short` layout or have other than status and bytes between the request
+    and the referer are passed to the regex parser.
+    """
+    fields = line.split('"')
+    if len(fields) == 13 and fields[0][-2:] == '] ' and fields[4] == fields[6] == fields[8] == fields[10] == ' ':
+        remote = fields[0].split(' ', 4)
+        if len(remote) != 5 or remote[2] or not remote[0] or not remote[1] or not remote[3] or remote[4][:1] != '[':
+            return parse_line_regex(line)
+        status = fields[2].split(' ')
+        if len(status) != 4 or status[0] or status[3] or not status[1] or not status[2]:
+            return parse_line_regex(line)
+        request = fields[1].split(' ')
+        tail = fields[12]
+        request_time = tail.strip()
+        if len(request) == 3 and request[0] and request[1] and request[2] and request_time and \
+                tail[:1] == ' ' and ' ' not in request_time and '\t' not in line:
+            return request[1], float(request_time) if request_time != '-' else 0
+    return parse_line_regex(line)
+
+
+PARSERS = {
+    'regex': parse_line_regex,
+    'fast': parse_line_fast,
+}
+
+
+def xreadlines(log_path, backend=None):
+    for line in linereader.read_lines(log_path, backend or CONFIG['READER']):
         if line:
             yield line
-    log.close()
 
 
-def run_analyze(log_path, is_json):
+class UrlNormalizer(object):
+    """
+    Reduce url to template: query string is stripped and every path segment fully matched
+    by a rule pattern is replaced by the rule template, e.g. /api/v2/banner/25019354?a=1 ->
+    /api/v2/banner/{id}. Templates are interned, so equal keys share one string.
+    """
+
+    def __init__(self, rules, cache_size=100000):
+        self.rules = [(re.compile('(?:%s)$' % pattern), template) for pattern, template in rules]
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def __call__(self, url):
+        try:
+            return self.cache[url]
+        except KeyError:
+            pass
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        key = self.cache[url] = intern(self.normalize(url))
+        return key
+
+    def normalize(self, url):
+        path = url.partition('?')[0].partition('#')[0]
+        segments = path.split('/')
+        for i, segment in enumerate(segments):
+            if segment:
+                for pattern, template in self.rules:
+                    if pattern.match(segment):
+                        segments[i] = template
+                        break
+        return '/'.join(segments)
+
+
+class TimeBucketer(object):
+    """Return label of time bucket start for `$time_local` of log line, e.g. 2017-06-29 03:50"""
+    epoch = datetime(1970, 1, 1)
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.cache = {}
+
+    def __call__(self, line):
+        start = line.find('[') + 1
+        minute = line[start:start + 17]  # 29/Jun/2017:03:50
+        try:
+            return self.cache[minute]
+        except KeyError:
+            pass
+        try:
+            moment = datetime.strptime(minute, '%d/%b/%Y:%H:%M')
+        except ValueError:
+            return None
+        minutes = int((moment - self.epoch).total_seconds()) // 60
+        moment = self.epoch + timedelta(minutes=minutes - minutes % self.minutes)
+        label = self.cache[minute] = intern(moment.strftime('%Y-%m-%d %H:%M'))
+        return label
+
+
+class TimeSketch(object):
+    """
+    Quantile sketch of request times with constant memory. Times are counted in logarithmic
+    buckets, so any percentile is estimated with the given relative accuracy, while count,
+    sum and max are exact. Sketches of the same accuracy can be merged.
+    """
+    __slots__ = ('accuracy', 'max_buckets', 'gamma', 'log_gamma', 'buckets', 'zero_count',
+                 'count', 'sum', 'min', 'max')
+
+    def __init__(self, accuracy=0.01, max_buckets=2048):
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > 0:
+            index = int(math.ceil(math.log(value) / self.log_gamma))
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            if len(self.buckets) > self.max_buckets:
+                self.collapse()
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise RuntimeError('Can not merge sketches with different accuracy')
+        if not other.count:
+            return self
+        self.count += other.count
+        self.sum += other.sum
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.iteritems():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self.collapse()
+        return self
+
+    def collapse(self):
+        """Merge the lowest buckets together, so only the smallest times lose accuracy"""
+        indexes = sorted(self.buckets)
+        overflow = indexes[:len(indexes) - self.max_buckets + 1]
+        self.buckets[overflow[-1]] = sum(self.buckets.pop(index) for index in overflow)
+
+    def ranks_index(self):
+        """Sorted bucket indexes and cumulative counts including zero bucket"""
+        indexes = sorted(self.buckets)
+        cumulative = []
+        seen = self.zero_count
+        for index in indexes:
+            seen += self.buckets[index]
+            cumulative.append(seen)
+        return indexes, cumulative
+
+    def value_at(self, rank, ranks_index=None):
+        """Estimated value of the element with given zero based rank in the sorted times"""
+        rank = min(max(rank, 0), self.count - 1)
+        if rank < self.zero_count:
+            return 0
+        indexes, cumulative = ranks_index or self.ranks_index()
+        position = bisect.bisect_right(cumulative, rank)
+        if position == len(indexes):
+            return self.max
+        value = 2 * self.gamma ** indexes[position] / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def percentile(self, p, ranks_index=None):
+        ranks_index = ranks_index or self.ranks_index()
+        index = (p / 100.0) * self.count
+        if math.floor(index) == index:
+            index = int(index)
+            return (self.value_at(index - 1, ranks_index) + self.value_at(index, ranks_index)) / 2.0
+        return self.value_at(int(math.floor(index)), ranks_index)
+
+    def percentiles(self, ps):
+        ranks_index = self.ranks_index()
+        return [self.percentile(p, ranks_index) for p in ps]
+
+
+def merge_times(times, other):
+    if isinstance(times, TimeSketch):
+        times.merge(other)
+    else:
+        times.extend(other)
+
+
+class LogStat(object):
+    """Mergeable aggregate of parsed log lines: request times per url and totals"""
+
+    def __init__(self, sketch_accuracy=None, top_capacity=None, series_top=None, series_accuracy=0.05):
+        if sketch_accuracy:
+            factory = functools.partial(TimeSketch, sketch_accuracy)
+        else:
+            factory = list
+        self.urls = collections.defaultdict(factory)
+        self.total_count = 0
+        self.total_time = 0
+        self.top_capacity = top_capacity
+        # url -> running time sum, kept with top_capacity to select urls to prune without summing their times
+        self.sums = {}
+        self.evicted_time = 0
+        # time bucket -> url -> TimeSketch, url keys are interned and shared between buckets
+        self.series = {}
+        self.series_top = series_top
+        self.series_accuracy = series_accuracy
+
+    def __setstate__(self, state):
+        """Keys of aggregates from the pool and the saved ones are interned again after unpickling"""
+        self.__dict__.update(state)
+        self.urls = collections.defaultdict(self.urls.default_factory,
+                                            ((intern(url), times) for url, times in self.urls.iteritems()))
+        self.sums = {intern(url): time_sum for url, time_sum in self.sums.iteritems()}
+        self.series = {intern(bucket): {intern(url): times for url, times in urls.iteritems()}
+                       for bucket, urls in self.series.iteritems()}
+
+    def merge(self, other):
+        sums = self.sums if self.top_capacity else None
+        for url, times in other.urls.iteritems():
+            url = intern(url)
+            merge_times(self.urls[url], times)
+            if sums is not None:
+                other_sum = other.sums.get(url)
+                if other_sum is None:
+                    other_sum = get_times_sum(times)
+                sums[url] = sums.get(url, 0) + other_sum
+        self.total_count += other.total_count
+        self.total_time += other.total_time
+        self.evicted_time += other.evicted_time
+        if self.top_capacity and len(self.urls) > self.top_capacity:
+            self.prune()
+        for bucket, other_urls in other.series.iteritems():
+            urls = self.series.setdefault(intern(bucket), {})
+            for url, times in other_urls.iteritems():
+                url = intern(url)
+                if url in urls:
+                    urls[url].merge(times)
+                else:
+                    urls[url] = times
+            if self.series_top and len(urls) > 2 * self.series_top:
+                self.prune_series(urls)
+        return self
+
+    def add_series(self, bucket, url, request_time):
+        urls = self.series.get(bucket)
+        if urls is None:
+            urls = self.series[bucket] = {}
+        times = urls.get(url)
+        if times is None:
+            if self.series_top and len(urls) >= 2 * self.series_top:
+                self.prune_series(urls)
+            times = urls[url] = TimeSketch(self.series_accuracy)
+        times.append(request_time)
+
+    def prune_series(self, urls):
+        """Keep `series_top` urls with the biggest time sum in the time bucket"""
+        sums = [(times.sum, url) for url, times in urls.iteritems()]
+        for time_sum, url in heapq.nsmallest(len(sums) - self.series_top, sums):
+            del urls[url]
+
+    def prune(self):
+        """
+        Keep a half of `top_capacity` urls with the biggest time sum (lossy counting of heavy hitters).
+        Url evicted and seen again starts from zero and may be evicted again by a later prune, each
+        eviction loses at most the biggest time sum evicted by that prune. So time sum of any url is
+        underestimated at most by `evicted_time` - the total of these per prune maximums, which adds
+        up over merged aggregates too.
+        """
+        sums = self.sums
+        keep = max(self.top_capacity // 2, 1)
+        evicted = heapq.nsmallest(len(sums) - keep, ((time_sum, url) for url, time_sum in sums.iteritems()))
+        for time_sum, url in evicted:
+            del self.urls[url]
+            del sums[url]
+        if evicted:
+            self.evicted_time += evicted[-1][0]
+
+
+# config settings changing the aggregate, saved aggregates built with other settings are not reused
+STAT_SETTINGS = ('SKETCH_ACCURACY', 'TOP_CAPACITY', 'NORMALIZE', 'NORMALIZE_RULES', 'BUCKET_MINUTES', 'BUCKET_TOP_URLS',
+                 'BUCKET_ACCURACY')
+
+
+def get_stat_settings(config):
+    return tuple(config[name] for name in STAT_SETTINGS)
+
+
+def new_log_stat(config):
+    return LogStat(config['SKETCH_ACCURACY'], config['TOP_CAPACITY'], config['BUCKET_TOP_URLS'],
+                   config['BUCKET_ACCURACY'])
+
+
+def collect_stat(lines, config=None):
+    config = config or CONFIG
+    stat = new_log_stat(config)
+    urls = stat.urls
+    sums = stat.sums
+    parse = PARSERS[config['PARSER']]
+    top_capacity = config['TOP_CAPACITY']
+    normalize = None
+    if config['NORMALIZE']:
+        normalize = UrlNormalizer(config['NORMALIZE_RULES'], config['NORMALIZE_CACHE_SIZE'])
+    get_bucket = None
+    if config['BUCKET_MINUTES']:
+        get_bucket = TimeBucketer(config['BUCKET_MINUTES'])
+    for line in lines:
+        parsed_line = parse(line)
+        if parsed_line:
+            request_url, request_time = parsed_line
+            if normalize:
+                request_url = normalize(request_url)
+            if get_bucket:
+                request_url = intern(request_url)
+                bucket = get_bucket(line)
+                if bucket:
+                    stat.add_series(bucket, request_url, request_time)
+            stat.total_count += 1
+            stat.total_time += request_time
+            urls[request_url].append(request_time)
+            if top_capacity:
+                sums[request_url] = sums.get(request_url, 0) + request_time
+                if len(urls) > top_capacity:
+                    stat.prune()
+    return stat
+
+
+def get_byte_chunks(log_path, chunk_size):
+    """Split plain log file into byte ranges aligned to the line endings"""
+    size = os.path.getsize(log_path)
+    with open(log_path, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = f.tell()
+            yield log_path, start, end
+            start = end
+
+
+def read_byte_chunk(log_path, start, end):
+    with open(log_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return list(linereader.split_lines([data]))
+
+
+def get_line_chunks(log_path, chunk_lines):
+    """Split log lines into blocks, used for gzip logs that can not be read from arbitrary offset"""
+    lines = xreadlines(log_path)
+    chunk = list(itertools.islice(lines, chunk_lines))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(lines, chunk_lines))
+
+
+def handle_chunk((chunk, config)):
+    if isinstance(chunk, tuple):
+        chunk = read_byte_chunk(*chunk)
+    return collect_stat(chunk, config)
+
+
+def collect_stat_parallel(log_path, workers, config=None):
+    config = config or CONFIG
+    if log_path.endswith('.gz'):
+        chunks = get_line_chunks(log_path, config['CHUNK_LINES'])
+    else:
+        chunks = get_byte_chunks(log_path, config['CHUNK_BYTES'])
+    pool = multiprocessing.Pool(workers)
+    stat = new_log_stat(config)
+    # imap keeps chunks order, so merged per url times are in the same order as in serial reading
+    for chunk_stat in pool.imap(handle_chunk, ((chunk, config) for chunk in chunks)):
+        stat.merge(chunk_stat)
+    pool.close()
+    pool.join()
+    return stat
+
+
+class OffsetReader(object):
+    """
+    Iterate complete lines of log file from the given byte offset (offset in uncompressed data for gzip)
+    and remember the offset after the last read line. Not finished last line is left for the next reading.
+    Gzip can't seek in compressed data, so seek of .gz log decompresses it from the start.
+    """
+
+    def __init__(self, log_path, offset=0):
+        self.log_path = log_path
+        self.offset = offset
+
+    def __iter__(self):
+        log = gzip.open(self.log_path, 'rb') if self.log_path.endswith('.gz') else open(self.log_path, 'rb')
+        try:
+            log.seek(self.offset)
+            for line in log:
+                if not line.endswith('\n'):
+                    break
+                self.offset += len(line)
+                yield line
+        finally:
+            log.close()
+
+
+def get_state_path(log_path, config=None):
+    """State is kept per absolute log path, so logs with the same name in different dirs do not share it"""
+    config = config or CONFIG
+    key = hashlib.md5(os.path.abspath(log_path)).hexdigest()
+    return os.path.join(config['STATE_DIR'], '%s-%s.state' % (os.path.basename(log_path), key))
+
+
+def load_state(state_path):
+    try:
+        with open(state_path, 'rb') as f:
+            return cPickle.load(f)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+
+
+def save_state(state_path, state):
+    state_dir = os.path.dirname(state_path)
+    if state_dir and not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, state_path)
+
+
+def collect_stat_incremental(log_path, config=None):
+    """Continue aggregation from the offset saved by the previous run, start over if log file was rotated"""
+    config = config or CONFIG
+    state_path = get_state_path(log_path, config)
+    state = load_state(state_path)
+    file_stat = os.stat(log_path)
+    settings = get_stat_settings(config)
+    if (not state or state['inode'] != file_stat.st_ino or state.get('settings') != settings or
+            (not log_path.endswith('.gz') and state['offset'] > file_stat.st_size)):
+        state = {
+            'inode': file_stat.st_ino,
+            'settings': settings,
+            'offset': 0,
+            'stat': new_log_stat(config),
+        }
+    reader = OffsetReader(log_path, state['offset'])
+    state['stat'].merge(collect_stat(reader, config))
+    state['offset'] = reader.offset
+    save_state(state_path, state)
+    return state['stat']
+
+
+def get_batch_files(pattern, date_from=None, date_to=None):
+    files = []
+    for log_path in glob.glob(pattern):
+        file_date = get_file_date(log_path)
+        if (date_from is None or file_date >= date_from) and (date_to is None or file_date <= date_to):
+            files.append(log_path)
+    files.sort(key=lambda x: (get_file_date(x), x))
+    return files
+
+
+def get_cache_path(log_path, config=None):
+    """Cached aggregate of log file is valid while file path, mtime, size and aggregate settings are the same"""
+    config = config or CONFIG
+    file_stat = os.stat(log_path)
+    key = hashlib.md5('%s:%r:%d:%r' % (os.path.abspath(log_path), file_stat.st_mtime, file_stat.st_size,
+                                       get_stat_settings(config))).hexdigest()
+    return os.path.join(config['CACHE_DIR'], '%s-%s.stat' % (os.path.basename(log_path), key))
+
+
+def collect_file_stat((log_path, config)):
+    cache_path = get_cache_path(log_path, config)
+    stat = load_state(cache_path)
+    if stat is None:
+        stat = collect_stat(xreadlines(log_path), config)
+        save_state(cache_path, stat)
+    return stat
+
+
+def collect_stat_batch(log_paths, workers, config=None):
+    """Merge aggregates of several log files, each file is parsed only if it has no valid cache"""
+    config = config or CONFIG
+    stat = new_log_stat(config)
+    tasks = [(log_path, config) for log_path in log_paths]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        for file_stat in pool.imap(collect_file_stat, tasks):
+            stat.merge(file_stat)
+        pool.close()
+        pool.join()
+    else:
+        for task in tasks:
+            stat.merge(collect_file_stat(task))
+    return stat
+
+
+def save_stat_report(stat, report_path):
+    if stat.total_count > 0 and stat.total_time > 0:
+        log_report = get_report(stat.urls, stat.total_count, stat.total_time, CONFIG['REPORT_SIZE'])
+        save_report(log_report, report_path)
+        if stat.series:
+            series_report = get_series_report(stat.series, CONFIG['BUCKET_TOP_URLS'])
+            save_report(series_report, get_series_path(report_path), 'rows')
+        return True
+    return False
+
+
+def run_batch(log_paths, is_json, workers=1):
+    report_format = 'json' if is_json else 'html'
+    report_dates = [datetime.strftime(get_file_date(log_paths[i]), '%Y.%m.%d') for i in (0, -1)]
+    report_path = '%s/report-%s-%s.%s' % (CONFIG['REPORT_DIR'], report_dates[0], report_dates[1], report_format)
+    print 'Start reading %d log files...' % len(log_paths)
+    stat = collect_stat_batch(log_paths, workers)
+    if save_stat_report(stat, report_path):
+        print 'Report file `%s` is ready!' % report_path
+    else:
+        print 'Logs data is empty or has incorrect data'
+
+
+def run_analyze(log_path, is_json, workers=1, incremental=False):
     report_format = 'json' if is_json else 'html'
     report_date = datetime.strftime(get_file_date(log_path), '%Y.%m.%d')
     report_path = '%s/report-%s.%s' % (CONFIG['REPORT_DIR'], report_date, report_format)
-    if os.path.isfile(report_path):
+    if os.path.isfile(report_path) and not incremental:
         print 'Report `%s` already exists' % report_path
         exit(0)
     print 'Start reading `%s` log file...' % log_path
-    log_stat = collections.defaultdict(list)
-    total_count = total_time = 0
-    for line in xreadlines(log_path):
-        parsed_line = parse_line(line)
-        if parsed_line:
-            total_count += 1
-            total_time += parsed_line['request_time']
-            log_stat[parsed_line['request_url']].append(parsed_line['request_time'])
-    if total_count > 0 and total_time > 0:
-        log_report = get_report(log_stat, total_count, total_time, CONFIG['REPORT_SIZE'])
-        save_report(log_report, report_path)
+    if incremental:
+        stat = collect_stat_incremental(log_path)
+    elif workers > 1:
+        stat = collect_stat_parallel(log_path, workers)
+    else:
+        stat = collect_stat(xreadlines(log_path))
+    if save_stat_report(stat, report_path):
         print 'Report file `%s` is ready!' % report_path
     else:
         print 'Log `%s` data is empty or has incorrect data' % log_path
@@ -169,13 +860,33 @@ def run_analyze(log_path, is_json):
 def main():
     args = parse_args()
     log_path = args.log_path
+    CONFIG['SKETCH_ACCURACY'] = args.sketch
+    CONFIG['PARSER'] = args.parser
+    CONFIG['READER'] = args.reader
+    CONFIG['TOP_CAPACITY'] = args.top_capacity
+    CONFIG['NORMALIZE'] = args.normalize
+    CONFIG['REPORT_LAYOUT'] = 'columns' if args.columnar else 'rows'
+    CONFIG['BUCKET_MINUTES'] = args.bucket_minutes
+
+    if args.glob or args.date_from or args.date_to:
+        try:
+            log_paths = get_batch_files(args.glob or CONFIG['LOG_DIR'] + '/nginx-access-ui.log-*',
+                                        args.date_from, args.date_to)
+            if not log_paths:
+                print 'No log files for the batch report'
+                return
+            run_batch(log_paths, args.json, args.workers)
+        except Exception as err:
+            print str(err)
+            sys.exit(1)
+        return
 
     if log_path is None:
         log_path = get_latest_file(CONFIG['LOG_DIR'])
 
     if log_path:
         try:
-            run_analyze(log_path, args.json)
+            run_analyze(log_path, args.json, args.workers, args.incremental)
         except Exception as err:
             print str(err)
             sys.exit(1)
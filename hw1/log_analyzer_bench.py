@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks of log_analyzer on synthetic `ui_short` logs.
+#
+# stages      - end-to-end run_analyze (lines/s, peak RSS) and time of read, parse, aggregate and report stages
+# percentiles - report with single sort summary against sort per each percentile
+# readers     - log reading and decompression backends
+#
+# $ python log_analyzer_bench.py stages -n 1000000 --gzip --profile analyze.prof
+
+import argparse
+import cProfile
+import gzip
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import linereader
+import log_analyzer
+
+LOG_LINE = ('{ip} -  - [29/Jun/2017:03:50:22 +0300] "GET {url} HTTP/1.1" 200 927 "-" '
+            '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752759" '
+            '"dc7161be3" {time:.3f}\n')
+
+LATENCY_DISTRIBUTIONS = {
+    'exp': lambda rnd, mean: rnd.expovariate(1 / mean),
+    'lognormal': lambda rnd, mean: rnd.lognormvariate(0, 1) * mean / 1.6487,
+    'pareto': lambda rnd, mean: (rnd.paretovariate(3) - 1) * mean * 2,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Nginx Log Analyzer Benchmark.')
+    parser.add_argument('bench', help='benchmark to run (default: stages)', nargs='?',
+                        choices=('stages', 'percentiles', 'readers'), default='stages')
+    parser.add_argument('-n', '--lines', help='count of synthetic log lines (default: 1000000)',
+                        type=int, default=1000000)
+    parser.add_argument('-u', '--urls', help='count of distinct urls (default: 1000)', type=int, default=1000)
+    parser.add_argument('-d', '--distribution', help='request time distribution (default: exp)',
+                        choices=sorted(LATENCY_DISTRIBUTIONS), default='exp')
+    parser.add_argument('-m', '--mean', help='mean request time (default: 0.2)', type=float, default=0.2)
+    parser.add_argument('-z', '--gzip', help='generate gzip log (default: plain)', action='store_true')
+    parser.add_argument('--seed', help='random seed', type=int, default=42)
+    parser.add_argument('-l', '--log_path', help='existing log file instead of synthetic one')
+    parser.add_argument('--profile', help='dump cProfile stats of the end-to-end run into the file')
+    parser.add_argument('-w', '--workers', type=int, default=log_analyzer.CONFIG['WORKERS'])
+    parser.add_argument('-s', '--sketch', type=float, default=log_analyzer.CONFIG['SKETCH_ACCURACY'])
+    parser.add_argument('-p', '--parser', choices=sorted(log_analyzer.PARSERS), default=log_analyzer.CONFIG['PARSER'])
+    parser.add_argument('-r', '--reader', choices=sorted(linereader.BACKENDS), default=log_analyzer.CONFIG['READER'])
+    return parser.parse_args()
+
+
+def generate_lines(count, urls=1000, seed=42, distribution='exp', mean=0.2):
+    """Synthetic ui_short log lines: zipf-like url popularity and given request times distribution"""
+    rnd = random.Random(seed)
+    latency = LATENCY_DISTRIBUTIONS[distribution]
+    for _ in xrange(count):
+        url_id = int(rnd.paretovariate(1.2)) % urls
+        yield LOG_LINE.format(ip='1.196.116.%d' % (url_id % 256), url='/api/v2/banner/%d' % url_id,
+                              time=latency(rnd, mean))
+
+
+def write_log(path, lines):
+    log = gzip.open(path, 'wb') if path.endswith('.gz') else open(path, 'wb')
+    try:
+        log.writelines(lines)
+    finally:
+        log.close()
+    return path
+
+
+def count_lines(lines):
+    count = 0
+    for _ in lines:
+        count += 1
+    return count
+
+
+def parse_lines(lines, parse):
+    count = 0
+    for line in lines:
+        if parse(line):
+            count += 1
+    return count
+
+
+def timeit(func, *args):
+    started = time.time()
+    result = func(*args)
+    return time.time() - started, result
+
+
+def get_peak_rss(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB (ru_maxrss is in KB on Linux)"""
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+def run_analyze(log_path, report_dir, workers, profile_path):
+    log_analyzer.CONFIG['REPORT_DIR'] = report_dir
+    if profile_path:
+        cProfile.runctx('log_analyzer.run_analyze(log_path, True, workers)', globals(),
+                        {'log_path': log_path, 'workers': workers}, profile_path)
+    else:
+        log_analyzer.run_analyze(log_path, True, workers)
+
+
+def bench_stages(log_path, workers, profile_path=None, tmp_dir=None):
+    """End-to-end run in a child process, so its peak RSS is measured apart from the benchmark itself"""
+    report_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        process = multiprocessing.Process(target=run_analyze, args=(log_path, report_dir, workers, profile_path))
+        started = time.time()
+        process.start()
+        process.join()
+        total_time = time.time() - started
+    finally:
+        shutil.rmtree(report_dir)
+    if process.exitcode:
+        raise RuntimeError('End-to-end run failed with code %d' % process.exitcode)
+    peak_rss = get_peak_rss(resource.RUSAGE_CHILDREN)
+
+    config = log_analyzer.CONFIG
+    read_time, count = timeit(count_lines, log_analyzer.xreadlines(log_path))
+    parse_time, parsed = timeit(parse_lines, log_analyzer.xreadlines(log_path), log_analyzer.PARSERS[config['PARSER']])
+    collect_time, stat = timeit(log_analyzer.collect_stat, log_analyzer.xreadlines(log_path))
+    report_time, report = timeit(log_analyzer.get_report, stat.urls, stat.total_count, stat.total_time,
+                                 config['REPORT_SIZE'])
+    save_path = os.path.join(tmp_dir or tempfile.gettempdir(), 'bench-report.json')
+    save_time, _ = timeit(log_analyzer.save_report, report, save_path)
+    os.remove(save_path)
+
+    print 'Lines: %d, parsed: %d, urls: %d' % (count, parsed, len(stat.urls))
+    print 'End-to-end (%d workers): %.3f s, %d lines/s, peak RSS %.1f MB' % (workers, total_time, count / total_time,
+                                                                          peak_rss)
+    print 'Stages (single process):'
+    print '  read:      %.3f s' % read_time
+    print '  parse:     %.3f s' % max(parse_time - read_time, 0)
+    print '  aggregate: %.3f s' % max(collect_time - parse_time, 0)
+    print '  report:    %.3f s' % report_time
+    print '  save:      %.3f s' % save_time
+    if profile_path:
+        print 'Profile of the end-to-end run is saved to `%s`' % profile_path
+
+
+def percentile_legacy(lst, p):
+    """percentile with its own sort, as it was before the single sort summary"""
+    lst = sorted(lst)
+    index = (p / 100.0) * len(lst)
+    if math.floor(index) == index:
+        result = (lst[int(index)-1] + lst[int(index)]) / 2.0
+    else:
+        result = lst[int(math.floor(index))]
+    return result
+
+
+def get_report_legacy(log_stat, total_count, total_time, limit=100, percentiles=None):
+    """Report with sort per each percentile of every url, as it was computed before the single sort summary"""
+    round_f = log_analyzer.round_f
+    one_count_percent = float(total_count / 100)
+    one_time_percent = float(total_time / 100)
+    percentiles = percentiles or log_analyzer.CONFIG['PERCENTILES']
+    report_data = []
+    for url, times in log_stat.items():
+        time_sum = sum(times)
+        row = {
+            'url': url,
+            'time_max': max(times),
+            'count': len(times),
+            'time_sum': round_f(time_sum),
+            'count_perc': round_f(len(times) / one_count_percent),
+            'time_perc': round_f(time_sum / one_time_percent),
+        }
+        for p in percentiles:
+            row['time_p%s' % p] = round_f(percentile_legacy(times, p))
+        report_data.append(row)
+    report_data.sort(key=lambda x: (x['time_perc'], x['time_sum'], x['url']), reverse=True)
+    return report_data[:limit]
+
+
+def bench_percentiles(log_path):
+    stat = log_analyzer.collect_stat(log_analyzer.xreadlines(log_path), dict(log_analyzer.CONFIG,
+                                                                             SKETCH_ACCURACY=None))
+    args = stat.urls, stat.total_count, stat.total_time, log_analyzer.CONFIG['REPORT_SIZE']
+    legacy_time, legacy_report = timeit(get_report_legacy, *args)
+    report_time, report = timeit(log_analyzer.get_report, *args)
+    assert report == legacy_report, 'Reports differ'
+    print 'Report with sort per percentile: %.3f s' % legacy_time
+    print 'Report with single sort:         %.3f s (x%.2f)' % (report_time, legacy_time / report_time)
+
+
+def bench_readers(log_path):
+    print 'Read `%s` (%.1f MB)...' % (log_path, os.path.getsize(log_path) / 1024.0 / 1024)
+    base_time = None
+    for backend in ('gzip', 'zlib', 'thread', 'zcat'):
+        read_time, count = timeit(count_lines, linereader.read_lines(log_path, backend))
+        base_time = base_time or read_time
+        print '%-7s %d lines: %.3f s, %d lines/s (x%.2f)' % (backend, count, read_time, count / read_time,
+                                                             base_time / read_time)
+
+
+def main():
+    args = parse_args()
+    log_analyzer.CONFIG.update({
+        'SKETCH_ACCURACY': args.sketch,
+        'PARSER': args.parser,
+        'READER': args.reader,
+    })
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        log_path = args.log_path
+        if not log_path:
+            log_path = os.path.join(tmp_dir, 'nginx-access-ui.log-20170630' + ('.gz' if args.gzip else ''))
+            print 'Generate %d lines with %d urls into `%s`...' % (args.lines, args.urls, log_path)
+            write_log(log_path, generate_lines(args.lines, args.urls, args.seed, args.distribution, args.mean))
+        if args.bench == 'stages':
+            bench_stages(log_path, args.workers, args.profile, tmp_dir)
+        elif args.bench == 'percentiles':
+            bench_percentiles(log_path)
+        else:
+            bench_readers(log_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -28,6 +28,7 @@
 
 
 import itertools
+import random
 
 
 def hand_rank(hand):
@@ -100,8 +101,8 @@ red_cards = [rank + suit for rank in '23456789TJQKA' for suit in 'HD']
 black_cards = [rank + suit for rank in '23456789TJQKA' for suit in 'CS']
 
 
-def best_wild_hand(hand):
-    """best_hand но с джокерами"""
+def best_wild_hand_brute(hand):
+    """best_wild_hand полным перебором замен джокеров, для проверки best_wild_hand"""
     simple_cards = [card for card in hand if card not in ['?B', '?R']]
     joker_cards = [card for card in hand if card in ['?B', '?R']]
 
@@ -119,6 +120,230 @@ def best_wild_hand(hand):
     return max(combinations, key=hand_rank)
 
 
+# Быстрый режим оценки. Карта кодируется целым числом как в Cactus Kev's evaluator:
+# бит ранга (16-28), бит масти (12-15), ранг (8-11) и простое число ранга (0-7).
+# Значение "руки" из 5ти карт - номер ее hand_rank среди всех возможных значений
+# hand_rank, таблицы строятся по самой hand_rank, поэтому порядок значений совпадает
+# с порядком hand_rank: hand_value(a) < hand_value(b) <=> hand_rank(a) < hand_rank(b)
+
+RANKS = '23456789TJQKA'
+SUITS = 'CDHS'
+RANK_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+
+def encode_card(card):
+    """Возвращает целочисленный код карты, например 'AS'"""
+    rank, suit = RANKS.index(card[0]), SUITS.index(card[1])
+    return (1 << (16 + rank)) | (1 << (12 + suit)) | (rank << 8) | RANK_PRIMES[rank]
+
+
+CARD_CODES = dict((rank + suit, encode_card(rank + suit)) for rank in RANKS for suit in SUITS)
+CARD_NAMES = dict((code, card) for card, code in CARD_CODES.items())
+
+
+class HandTables(object):
+    """Таблицы значений "рук" из 5ти карт:
+    flushes - по маске рангов одномастной руки
+    unique - по маске рангов руки из 5ти разных рангов
+    products - по произведению простых чисел рангов руки с повторами рангов
+    ranks - значение hand_rank по значению руки
+    и лучших "рук" из 5ти карт среди 5-7 карт:
+    best_products - по произведению простых чисел рангов: значение и ранги лучшей руки без флеша
+    best_flushes - по маске рангов карт одной масти: значение и маска рангов лучшего флеша"""
+
+    def __init__(self):
+        flush_hands, other_hands = [], []
+        for ranks in itertools.combinations_with_replacement(RANKS, 5):
+            if max(ranks.count(r) for r in ranks) > 4:
+                continue
+            if len(set(ranks)) == 5:
+                flush_hands.append([r + 'S' for r in ranks])
+                other_hands.append([r + s for r, s in zip(ranks, 'CDHSC')])
+            else:
+                other_hands.append([r + SUITS[ranks[:i].count(r)] for i, r in enumerate(ranks)])
+        hands = flush_hands + other_hands
+        keys = [freeze(hand_rank(hand)) for hand in hands]
+        # значения начинаются с 1, 0 в таблицах - нет значения
+        self.ranks = [None] + sorted(set(keys))
+        values = dict((key, value) for value, key in enumerate(self.ranks))
+
+        self.flushes = [0] * (1 << 13)
+        self.unique = [0] * (1 << 13)
+        self.products = {}
+        for hand, key in zip(hands, keys):
+            codes = [CARD_CODES[card] for card in hand]
+            bits = reduce(lambda a, b: a | b, codes) >> 16
+            if all(code & 0xF000 == codes[0] & 0xF000 for code in codes):
+                self.flushes[bits] = values[key]
+            elif len(set(card[0] for card in hand)) == 5:
+                self.unique[bits] = values[key]
+            else:
+                self.products[reduce(lambda a, b: a * b, [code & 0xFF for code in codes])] = values[key]
+
+        self.best_products = {}
+        for size in (5, 6, 7):
+            for ranks in itertools.combinations_with_replacement(range(13), size):
+                if max(ranks.count(r) for r in ranks) > 4:
+                    continue
+                product = reduce(lambda a, b: a * b, [RANK_PRIMES[r] for r in ranks])
+                if size == 5:
+                    value = self.unique[rank_mask(ranks)] if len(set(ranks)) == 5 else self.products[product]
+                    self.best_products[product] = (value, ranks)
+                else:
+                    # лучшая рука среди рук без одной карты
+                    self.best_products[product] = max(self.best_products[product // RANK_PRIMES[r]]
+                                                      for r in set(ranks))
+        self.best_flushes = [None] * (1 << 13)
+        for size in (5, 6, 7):
+            for ranks in itertools.combinations(range(13), size):
+                mask = rank_mask(ranks)
+                if size == 5:
+                    self.best_flushes[mask] = (self.flushes[mask], mask)
+                else:
+                    self.best_flushes[mask] = max(self.best_flushes[mask & ~(1 << r)] for r in ranks)
+
+
+def rank_mask(ranks):
+    mask = 0
+    for r in ranks:
+        mask |= 1 << r
+    return mask
+
+
+def freeze(rank):
+    """Значение hand_rank со списками, замененными на кортежи, для ключей словаря"""
+    return tuple(tuple(x) if isinstance(x, list) else x for x in rank)
+
+
+_tables = []
+
+
+def get_tables():
+    """Таблицы строятся один раз, при первом обращении"""
+    if not _tables:
+        _tables.append(HandTables())
+    return _tables[0]
+
+
+def evaluate(c1, c2, c3, c4, c5):
+    """Значение "руки" из 5ти кодов карт, больше - лучше"""
+    tables = _tables[0] if _tables else get_tables()
+    if c1 & c2 & c3 & c4 & c5 & 0xF000:
+        return tables.flushes[(c1 | c2 | c3 | c4 | c5) >> 16]
+    value = tables.unique[(c1 | c2 | c3 | c4 | c5) >> 16]
+    if value:
+        return value
+    return tables.products[(c1 & 0xFF) * (c2 & 0xFF) * (c3 & 0xFF) * (c4 & 0xFF) * (c5 & 0xFF)]
+
+
+def hand_value(hand):
+    """Значение "руки" из 5ти карт, упорядоченное так же, как hand_rank"""
+    return evaluate(*[CARD_CODES[card] for card in hand])
+
+
+def value_rank(value):
+    """Значение hand_rank по значению hand_value"""
+    return get_tables().ranks[value]
+
+
+def evaluate_best(codes):
+    """Лучшая "рука" из 5ти среди 5-7 кодов карт, за один проход по картам
+    считаются произведение простых чисел рангов и маски рангов по мастям.
+    Возвращает значение руки, бит масти флеша (0 - без флеша) и ранги руки:
+    маску рангов для флеша, иначе кортеж рангов"""
+    tables = _tables[0] if _tables else get_tables()
+    product = 1
+    suits = {}
+    for code in codes:
+        product *= code & 0xFF
+        suit = code & 0xF000
+        suits[suit] = suits.get(suit, 0) | code
+    value, ranks = tables.best_products[product]
+    if len(suits) > len(codes) - 4:
+        return value, 0, ranks
+    # в руке не больше 7ми карт, поэтому флеш возможен только в одной масти
+    for suit, mask in suits.items():
+        best_flush = tables.best_flushes[mask >> 16]
+        if best_flush and best_flush[0] > value:
+            return best_flush[0], suit, best_flush[1]
+    return value, 0, ranks
+
+
+def best_value(hand):
+    """Значение лучшей "руки" из 5ти среди 5-7 карт в порядке hand_rank"""
+    return evaluate_best([CARD_CODES[card] for card in hand])[0]
+
+
+def best_hand_value(hand):
+    """Лучшая "рука" из 5ти карт среди 5-7 карт и ее значение. Возвращает те же карты,
+    что и best_hand: среди равных по значению рук best_hand выбирает первую комбинацию,
+    то есть для каждого ранга лучшей руки - первые карты этого ранга"""
+    codes = [CARD_CODES[card] for card in hand]
+    if len(hand) > 7:
+        best = max(itertools.combinations(codes, 5), key=lambda cards: evaluate(*cards))
+        return tuple(CARD_NAMES[code] for code in best), evaluate(*best)
+    value, suit, ranks = evaluate_best(codes)
+    if suit:
+        return tuple(card for card, code in zip(hand, codes) if code & suit and (code >> 16) & ranks), value
+    need = [0] * 13
+    for r in ranks:
+        need[r] += 1
+    best = []
+    for card, code in zip(hand, codes):
+        r = (code >> 8) & 0xF
+        if need[r]:
+            need[r] -= 1
+            best.append(card)
+    return tuple(best), value
+
+
+def best_hand_fast(hand):
+    """best_hand на прямой оценке 5-7 карт"""
+    return best_hand_value(hand)[0]
+
+
+WILD_CARDS = {'?R': red_cards, '?B': black_cards}
+WILD_SUITS = {'?R': 'HD', '?B': 'CS'}
+
+
+def best_wild_hand(hand):
+    """best_hand но с джокерами. Замены джокеров перебираются лениво в том же
+    порядке, что и при полном переборе, и лучшая рука каждой замены оценивается
+    сразу, поэтому результат совпадает с best_wild_hand_brute, а память не растет.
+    Масти, в которых флеш невозможен даже со всеми джокерами, не различаются:
+    замены, отличающиеся только такими мастями, дают одинаковое значение руки,
+    и оценивается только первая из них. Перебор останавливается на роял флеше."""
+    simple_cards = [card for card in hand if card not in WILD_CARDS]
+    jokers = [card for card in hand if card in WILD_CARDS]
+    if len(set(jokers)) < len(jokers) or len(hand) > 7:
+        # в колоде по одному джокеру каждого цвета, одинаковые джокеры могут
+        # заменить одну и ту же карту, такие руки таблицы не оценивают,
+        # как и руки больше 7ми карт
+        return best_wild_hand_brute(hand)
+    simple_codes = [CARD_CODES[card] for card in simple_cards]
+
+    flush_suits = set(suit for suit in SUITS
+                      if sum(1 for card in simple_cards if card[1] == suit) +
+                      sum(1 for joker in jokers if suit in WILD_SUITS[joker]) >= 5)
+    candidates = [[(card, CARD_CODES[card], card if card[1] in flush_suits else card[0])
+                   for card in WILD_CARDS[joker] if card not in simple_cards] for joker in jokers]
+
+    top_value = len(get_tables().ranks) - 1
+    best_value, best = 0, None
+    seen = set()
+    for substitution in itertools.product(*candidates):
+        key = tuple(k for _, _, k in substitution)
+        if key in seen:
+            continue
+        seen.add(key)
+        value = evaluate_best(simple_codes + [code for _, code, _ in substitution])[0]
+        if value > best_value:
+            best_value, best = value, substitution
+            if value == top_value:
+                break
+    return best_hand_fast(simple_cards + [card for card, _, _ in best])
+
+
 def test_best_hand():
     print "test_best_hand..."
     assert (sorted(best_hand("6C 7C 8C 9C TC 5C JS".split()))
@@ -140,6 +365,49 @@ def test_best_wild_hand():
             == ['7C', 'TC', 'TD', 'TH', 'TS'])
     assert (sorted(best_wild_hand("JD TC TH 7C 7D 7S 7H".split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    assert (sorted(best_wild_hand("2D 6C 7C 8C 9C 5C 3H ?B".split()))
+            == ['6C', '7C', '8C', '9C', 'TC'])
+    print 'OK'
+
+
+def test_hand_value():
+    print "test_hand_value..."
+    hands = ["6C 7C 8C 9C TC", "7C 7D 7H 7S JD", "TD TC TH 8C 8S", "2D 5D 7D 9D JD", "5C 6D 7H 8S 9C",
+             "AC 2D 3H 4S 5C", "2C 2D 2H 9S JC", "TD TC 5H 5C 7C", "2C 2D 5H 5C 7C", "AD AC 9H 5C 7C",
+             "AD KC 9H 5C 7C", "7D 5C 4H 3C 2C"]
+    hands = [hand.split() for hand in hands]
+    assert (sorted(hands, key=hand_value) == sorted(hands, key=hand_rank))
+    for hand in hands:
+        assert value_rank(hand_value(hand)) == freeze(hand_rank(hand))
+    assert hand_value("AS KS QS JS TS".split()) == len(get_tables().ranks) - 1
+    for hand in ("6C 7C 8C 9C TC 5C JS", "TD TC TH 7C 7D 8C 8S", "JD TC TH 7C 7D 7S 7H", "2C 2D 5H 5C 7C 9S KD"):
+        assert best_hand_fast(hand.split()) == best_hand(hand.split())
+        assert best_value(hand.split()) == hand_value(best_hand(hand.split()))
+    print 'OK'
+
+
+def test_best_hand_fast():
+    print "test_best_hand_fast..."
+    hands = ["6C 7C 8C 9C TC 5C JS", "TD TC TH 7C 7D 8C 8S", "JD TC TH 7C 7D 7S 7H", "AS 2S 3S 4S 5S 6D 7H",
+             "AS KD AD KS QH QC JH", "2C 2D 2H 5S 5C 9C KD", "7H 2H 9H KH 8D 4H AC", "9S 9D 9C 9H 4S 5S 6S",
+             "AS KS QS JS TS 9S 8S", "2C 3D 4H 5S 6C", "QS 8D 3H QD 2C 3S"]
+    for hand in hands:
+        assert best_hand_fast(hand.split()) == best_hand(hand.split()), hand
+    print 'OK'
+
+
+def test_best_wild_hand_brute():
+    print "test_best_wild_hand_brute..."
+    rnd = random.Random(42)
+    deck = sorted(CARD_CODES)
+    hands = [rnd.sample(deck, 6) + [rnd.choice(WILD_CARDS.keys())] for _ in range(100)]
+    hands += [rnd.sample(deck, 5) + ['?R', '?B'] for _ in range(5)]
+    hands += [[c for c in deck if c[1] == 'H'][:5] + ['?R', '?B'], "6C 7C 8C 9C TC 5C ?B".split(),
+              "TD TC 5H 5C 7C ?R ?B".split(), "2H 2D 2S 2C 3H 4H ?R".split(), "AS 3H 4H 5H 9D ?R ?R".split(),
+              "AS 3H 4H 5H 9D KC QD ?R".split()]
+    for hand in hands:
+        rnd.shuffle(hand)
+        assert best_wild_hand(hand) == best_wild_hand_brute(hand), hand
     print 'OK'
 
 
@@ -189,6 +457,9 @@ def test_two_pair():
 if __name__ == '__main__':
     test_best_hand()
     test_best_wild_hand()
+    test_hand_value()
+    test_best_hand_fast()
+    test_best_wild_hand_brute()
     test_card_ranks()
     test_flush()
     test_straight()
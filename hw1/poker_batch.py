@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Bulk ranking of poker hands: one hand of 5-7 space-separated cards per line.
+# Hands are ranked by chunks in worker processes, which inherit evaluator tables
+# built by the parent before fork, and results are streamed out in input order:
+#
+# $ python poker_batch.py hands.txt -w 4 -o ranked.txt
+# $ cat hands.txt | python poker_batch.py > ranked.txt
+#
+# Each output line is the best five cards of the hand and its value: values of
+# different hands order as their hand_rank.
+
+import argparse
+import collections
+import multiprocessing
+import sys
+import time
+
+import linereader
+import poker
+
+CHUNK_SIZE = 10000
+CHUNKS_PER_WORKER = 4
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Poker Hands Bulk Ranking.')
+    parser.add_argument('input', help='file of hands, plain or gzip (default: stdin)', nargs='?')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('-w', '--workers', help='count of worker processes (default: 1)', type=int, default=1)
+    parser.add_argument('-c', '--chunk_size', help='hands per chunk (default: %d)' % CHUNK_SIZE, type=int,
+                        default=CHUNK_SIZE)
+    return parser.parse_args()
+
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rank_chunk(hands):
+    """Best five cards and value of each hand given by line or list of cards, None for empty line"""
+    best_hand_value = poker.best_hand_value
+    results = []
+    for hand in hands:
+        cards = hand.split() if isinstance(hand, basestring) else hand
+        if not cards:
+            results.append(None)
+            continue
+        if not 5 <= len(cards) <= 7:
+            raise ValueError('Expected 5-7 cards in hand `%s`' % ' '.join(cards))
+        if len(set(cards)) < len(cards):
+            duplicates = sorted(set(card for card in cards if cards.count(card) > 1))
+            raise ValueError('Duplicate card %s in hand `%s`' % (', '.join(duplicates), ' '.join(cards)))
+        try:
+            results.append(best_hand_value(cards))
+        except KeyError as e:
+            raise ValueError('Unexpected card %s in hand `%s`' % (e, ' '.join(cards)))
+    return results
+
+
+def format_result(result):
+    if result is None:
+        return ''
+    cards, value = result
+    return '%s\t%d' % (' '.join(cards), value)
+
+
+def format_chunk(hands):
+    """Output lines of the chunk as a single string, which is cheaper to pass from worker than results"""
+    return ''.join(format_result(result) + '\n' for result in rank_chunk(hands))
+
+
+def map_chunks(handle, items, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Generate handle(chunk) of each chunk of the items in order. Only
+    CHUNKS_PER_WORKER chunks per worker are in flight, so items are
+    read lazily and memory does not grow with the input.
+    """
+    poker.get_tables()
+    chunks = iter_chunks(items, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            yield handle(chunk)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(handle, (chunk,)))
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def rank_hands(hands, workers=1, chunk_size=CHUNK_SIZE):
+    """Generate (best five cards, value) of each hand of the iterable in order"""
+    for results in map_chunks(rank_chunk, hands, workers, chunk_size):
+        for result in results:
+            yield result
+
+
+def rank_file(path, workers=1, chunk_size=CHUNK_SIZE):
+    return rank_hands(linereader.read_lines(path), workers, chunk_size)
+
+
+def main():
+    args = parse_args()
+    hands = linereader.read_lines(args.input) if args.input else sys.stdin
+    output = open(args.output, 'w') if args.output else sys.stdout
+    poker.get_tables()
+    started = time.time()
+    count = 0
+    try:
+        for text in map_chunks(format_chunk, hands, args.workers, args.chunk_size):
+            output.write(text)
+            count += text.count('\n')
+    finally:
+        if args.output:
+            output.close()
+    elapsed = time.time() - started
+    sys.stderr.write('%d hands: %.3f s, %d hands/s\n' % (count, elapsed, count / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks of poker hand evaluators on random hands.
+#
+# rank - 5-card hands: hand_rank against table hand_value / evaluate on card codes
+# best - 7-card hands: best_hand against 21 table evaluations and direct evaluation of best_hand_fast
+# bulk - poker_batch ranking of a file of 7-card hands with 1 and given count of workers
+#
+# $ python poker_bench.py rank -n 1000000
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import linereader
+import poker
+import poker_batch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Poker Evaluator Benchmark.')
+    parser.add_argument('bench', help='benchmark to run (default: rank)', nargs='?', choices=('rank', 'best', 'bulk'),
+                        default='rank')
+    parser.add_argument('-n', '--hands', help='count of random hands (default: 1000000)', type=int, default=1000000)
+    parser.add_argument('--seed', help='random seed', type=int, default=42)
+    parser.add_argument('-w', '--workers', help='count of workers of bulk ranking (default: cpu count)', type=int,
+                        default=multiprocessing.cpu_count())
+    return parser.parse_args()
+
+
+def generate_hands(count, size, seed=42):
+    rnd = random.Random(seed)
+    deck = sorted(poker.CARD_CODES)
+    return [rnd.sample(deck, size) for _ in xrange(count)]
+
+
+def timeit(func, *args):
+    started = time.time()
+    result = func(*args)
+    return time.time() - started, result
+
+
+def rank_all(hands, rank):
+    return [rank(hand) for hand in hands]
+
+
+def evaluate_all(hands):
+    evaluate = poker.evaluate
+    return [evaluate(c1, c2, c3, c4, c5) for c1, c2, c3, c4, c5 in hands]
+
+
+def best_hand_combinations(hand):
+    """best_hand with table evaluation of each of 21 combinations"""
+    codes = [poker.CARD_CODES[card] for card in hand]
+    best = max(itertools.combinations(codes, 5), key=lambda cards: poker.evaluate(*cards))
+    return tuple(poker.CARD_NAMES[code] for code in best)
+
+
+def evaluate_best_all(hands):
+    evaluate_best = poker.evaluate_best
+    return [evaluate_best(codes) for codes in hands]
+
+
+def report(name, count, seconds, base=None):
+    print '%-16s %d hands: %.3f s, %d hands/s%s' % (name, count, seconds, count / seconds,
+                                                     ' (x%.1f)' % (base / seconds) if base else '')
+
+
+def bench_rank(count, seed):
+    hands = generate_hands(count, 5, seed)
+    table_time, _ = timeit(poker.get_tables)
+    print 'Tables are built in %.3f s' % table_time
+    base, ranks = timeit(rank_all, hands, poker.hand_rank)
+    report('hand_rank', count, base)
+    value_time, values = timeit(rank_all, hands, poker.hand_value)
+    report('hand_value', count, value_time, base)
+    codes = [[poker.CARD_CODES[card] for card in hand] for hand in hands]
+    evaluate_time, _ = timeit(evaluate_all, codes)
+    report('evaluate', count, evaluate_time, base)
+    for a, b, value_a, value_b in zip(ranks, ranks[1:1000], values, values[1:1000]):
+        assert cmp(a, b) == cmp(value_a, value_b)
+
+
+def bench_best(count, seed):
+    hands = generate_hands(count, 7, seed)
+    poker.get_tables()
+    base, best = timeit(rank_all, hands, poker.best_hand)
+    report('best_hand', count, base)
+    combinations_time, combinations_best = timeit(rank_all, hands, best_hand_combinations)
+    report('21 evaluate', count, combinations_time, base)
+    fast_time, fast_best = timeit(rank_all, hands, poker.best_hand_fast)
+    report('best_hand_fast', count, fast_time, base)
+    codes = [[poker.CARD_CODES[card] for card in hand] for hand in hands]
+    evaluate_time, _ = timeit(evaluate_best_all, codes)
+    report('evaluate_best', count, evaluate_time, base)
+    assert best == combinations_best == fast_best
+
+
+def bench_bulk(count, seed, workers):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'hands.txt')
+        with open(path, 'w') as f:
+            for hand in generate_hands(count, 7, seed):
+                f.write(' '.join(hand) + '\n')
+        poker.get_tables()
+        for workers in sorted(set((1, workers))):
+            bulk_time, _ = timeit(count_lines, poker_batch.map_chunks(poker_batch.format_chunk,
+                                                                      linereader.read_lines(path), workers))
+            report('bulk %d workers' % workers, count, bulk_time)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def count_lines(texts):
+    return sum(text.count('\n') for text in texts)
+
+
+def main():
+    args = parse_args()
+    if args.bench == 'rank':
+        bench_rank(args.hands, args.seed)
+    elif args.bench == 'best':
+        bench_best(args.hands, args.seed)
+    else:
+        bench_bulk(args.hands, args.seed, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+import os
+import shutil
+import StringIO
+import json
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+import deco
+
+
+class TestMemo(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.time = deco.time.time
+        deco.time.time = lambda: self.now
+
+    def tearDown(self):
+        deco.time.time = self.time
+
+    def memoize(self, **kwargs):
+        calls = []
+
+        @deco.memo(**kwargs)
+        def square(x, power=2):
+            calls.append(x)
+            return x ** power
+        self.calls = calls
+        return square
+
+    def test_unbounded(self):
+        square = self.memoize()
+        self.assertEqual([4, 9, 4, 9], [square(2), square(3), square(2), square(3)])
+        self.assertEqual(2, len(self.calls))
+        self.assertEqual((2, 2, 0), (square.hits, square.misses, square.evictions))
+
+    def test_kwargs(self):
+        square = self.memoize()
+        self.assertEqual([4, 8, 8], [square(2), square(2, power=3), square(2, power=3)])
+        self.assertEqual(2, len(self.calls))
+
+    def test_kwargs_order(self):
+        @deco.memo
+        def f(a, b=0, c=0):
+            self.calls.append(a)
+            return a + b * c
+        self.calls = []
+        self.assertEqual([7, 7, 7], [f(1, b=2, c=3), f(1, c=3, b=2), f(a=1, c=3, b=2)])
+        self.assertEqual(2, len(self.calls))
+        self.assertEqual(deco.make_key((1,), {'b': 2, 'c': 3}), deco.make_key((1,), {'c': 3, 'b': 2}))
+        self.assertNotEqual(deco.make_key((1, 'b', 2), {}), deco.make_key((1,), {'b': 2}))
+
+    def test_wrapped_attrs(self):
+        for kwargs in ({}, {'maxsize': 2}):
+            square = deco.memo(**kwargs)(deco.countcalls(lambda x: x * x))
+            square(2)
+            square(3)
+            square(2)
+            self.assertEqual(2, square.calls)
+            outer = deco.memo(**kwargs)(square)
+            outer(2)
+            outer(4)
+            self.assertEqual((0, 2), (outer.hits, outer.misses))
+            self.assertEqual((2, 3), (square.hits, square.misses))
+
+    def test_maxsize(self):
+        square = self.memoize(maxsize=2)
+        for x in (1, 2, 1, 3, 1, 2):
+            self.assertEqual(x * x, square(x))
+        # 2 is evicted by 3 as least recently used, 3 is evicted by 2
+        self.assertEqual(4, len(self.calls))
+        self.assertEqual((2, 4, 2), (square.hits, square.misses, square.evictions))
+        self.assertEqual(2, len(square.cache))
+
+    def test_most_recent_hits(self):
+        square = self.memoize(maxsize=2)
+        for x in (1, 1, 1, 2, 2, 3, 3, 1):
+            self.assertEqual(x * x, square(x))
+        self.assertEqual([1, 2, 3, 1], self.calls)
+        self.assertEqual(2, len(square.cache))
+
+    def test_ttl(self):
+        square = self.memoize(ttl=10)
+        square(2)
+        self.now += 5
+        square(2)
+        self.assertEqual(1, len(self.calls))
+        self.now += 10
+        square(2)
+        self.assertEqual(2, len(self.calls))
+        self.assertEqual((1, 2, 1), (square.hits, square.misses, square.evictions))
+
+    def test_ttl_purges_expired(self):
+        square = self.memoize(ttl=10)
+        for x in range(1000):
+            square(x)
+            self.now += 1
+        # keys never requested again are dropped once expired, not kept until their next lookup
+        self.assertEqual(set(range(990, 1000)), set(key[0] for key in square.cache))
+        self.assertEqual(990, square.evictions)
+
+    def test_cache_clear(self):
+        for kwargs in ({}, {'maxsize': 2}):
+            square = self.memoize(**kwargs)
+            square(2)
+            square.cache_clear()
+            self.assertEqual((0, 0, 0), (square.hits, square.misses, square.evictions))
+            square(2)
+            self.assertEqual(2, len(self.calls))
+
+    def test_recursion(self):
+        @deco.memo(maxsize=10)
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+        self.assertEqual(89, fib(10))
+        self.assertEqual(10, len(fib.cache))
+
+
+class TestNAry(unittest.TestCase):
+    def test_right_fold(self):
+        pair = deco.n_ary(lambda x, y: (x, y))
+        self.assertEqual(1, pair(1))
+        self.assertEqual((1, 2), pair(1, 2))
+        self.assertEqual((1, (2, (3, 4))), pair(1, 2, 3, 4))
+        self.assertRaises(TypeError, pair)
+
+    def test_many_args(self):
+        add = deco.n_ary(lambda x, y: x + y)
+        sub = deco.n_ary(lambda x, y: x - y)
+        self.assertEqual(sum(range(10000)), add(*range(10000)))
+        self.assertEqual(-5000, sub(*range(10000)))
+
+    def test_fold(self):
+        add = deco.n_ary(lambda x, y: x + y)
+        self.assertEqual(45, add.fold(x for x in range(10)))
+        self.assertEqual(45, add.fold(range(10)))
+        self.assertEqual('abc', add.fold('abc'))
+        self.assertRaises(TypeError, add.fold, iter([]))
+
+
+class TestSyncMemo(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def slow_square(self, x):
+        self.calls.append(x)
+        time.sleep(0.05)
+        if x < 0:
+            raise ValueError(x)
+        return x * x
+
+    def call_concurrently(self, func, args, threads=8):
+        results = []
+
+        def call(x):
+            try:
+                results.append(func(x))
+            except ValueError as e:
+                results.append(e)
+        workers = [threading.Thread(target=call, args=(args[i % len(args)],)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_single_flight(self):
+        for kwargs in ({}, {'maxsize': 2}):
+            self.calls = []
+            square = deco.sync_memo(self.slow_square, **kwargs)
+            results = self.call_concurrently(square, [2, 3])
+            self.assertEqual([4, 9], sorted(set(results)))
+            self.assertEqual([2, 3], sorted(self.calls))
+            self.assertEqual(8, square.hits + square.misses)
+            self.assertEqual(4, square(2))
+            self.assertEqual(2, len(self.calls))
+
+    def test_error(self):
+        square = deco.sync_memo(self.slow_square)
+        results = self.call_concurrently(square, [-1], threads=4)
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(isinstance(e, ValueError) for e in results))
+        self.assertEqual(0, len(square.cache))
+        self.assertRaises(ValueError, square, -1)
+
+    def test_exit(self):
+        def slow_exit(x):
+            self.calls.append(x)
+            time.sleep(0.05)
+            raise SystemExit(x)
+        square = deco.sync_memo(slow_exit)
+        results = []
+
+        def call(x):
+            try:
+                results.append(square(x))
+            except SystemExit as e:
+                results.append(e)
+        workers = [threading.Thread(target=call, args=(1,)) for i in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(isinstance(e, SystemExit) for e in results))
+        self.assertEqual([1], self.calls)
+        self.assertEqual(0, len(square.cache))
+        self.assertRaises(SystemExit, square, 1)
+
+    def test_recursion(self):
+        @deco.sync_memo
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+        self.assertEqual(89, fib(10))
+        self.assertEqual(11, len(fib.cache))
+
+
+class TestDiskStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_shared(self):
+        calls = []
+
+        def add(a, b=0):
+            calls.append(a)
+            return a + b
+        # the same function memoized in two processes
+        store = deco.DiskStore(self.tmp_dir)
+        first = deco.sync_memo(add, store=store)
+        second = deco.sync_memo(add, store=deco.DiskStore(self.tmp_dir))
+        self.assertEqual([3, 3, 1], [first(1, b=2), second(1, b=2), second(1)])
+        self.assertEqual([1, 1], calls)
+        store.clear()
+        self.assertRaises(KeyError, store.get, 'key')
+
+    def test_ttl(self):
+        store = deco.DiskStore(self.tmp_dir, ttl=10)
+        store.set('key', {'value': 1})
+        self.assertEqual({'value': 1}, store.get('key'))
+        path = store.get_path('key')
+        mtime = time.time() - 20
+        os.utime(path, (mtime, mtime))
+        self.assertRaises(KeyError, store.get, 'key')
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.time = deco.time.time
+        deco.time.time = lambda: self.now
+        self.profiler = deco.Profiler()
+
+    def tearDown(self):
+        deco.time.time = self.time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def test_times(self):
+        @deco.profile(profiler=self.profiler, name='inner')
+        def inner():
+            self.sleep(0.001)
+
+        @deco.profile(profiler=self.profiler, name='outer')
+        def outer():
+            self.sleep(0.002)
+            inner()
+            inner()
+
+        outer()
+        outer()
+        profiles = dict((p['name'], p) for p in self.profiler.export())
+        self.assertEqual((2, 4), (profiles['outer']['calls'], profiles['inner']['calls']))
+        self.assertAlmostEqual(0.008, profiles['outer']['total_time'])
+        self.assertAlmostEqual(0.004, profiles['outer']['self_time'])
+        self.assertAlmostEqual(0.004, profiles['inner']['total_time'])
+        self.assertAlmostEqual(0.004, profiles['inner']['self_time'])
+        self.assertAlmostEqual(0.004, profiles['outer']['max_time'])
+        # 1000 us is in [512, 1024) bucket and 4000 us in [2048, 4096) one
+        self.assertEqual({1024: 4}, profiles['inner']['histogram'])
+        self.assertEqual({4096: 2}, profiles['outer']['histogram'])
+
+    def test_sampling(self):
+        @deco.profile(profiler=self.profiler, rate=0.25)
+        def f(x):
+            self.sleep(0.001)
+            return x
+        self.assertEqual(range(100), [f(x) for x in range(100)])
+        p = self.profiler.export()[0]
+        self.assertEqual((100, 25), (p['calls'], p['sampled']))
+        self.assertAlmostEqual(0.1, p['total_time'])
+
+    def test_disabled(self):
+        f = deco.profile(lambda x: x, profiler=self.profiler)
+        self.profiler.enabled = False
+        self.assertEqual(1, f(1))
+        self.assertEqual(0, self.profiler.export()[0]['calls'])
+
+    def test_error(self):
+        def fail():
+            self.sleep(0.001)
+            raise ValueError()
+        f = deco.profile(fail, profiler=self.profiler)
+        self.assertRaises(ValueError, f)
+        self.assertEqual(1, self.profiler.export()[0]['sampled'])
+        self.assertEqual([], self.profiler.get_stack())
+
+    def test_dump(self):
+        def f():
+            self.sleep(0.001)
+        module = types.ModuleType('hot')
+        module.f = f
+        deco.profile_names(module, ['f'], profiler=self.profiler)
+        module.f()
+        stream = StringIO.StringIO()
+        self.profiler.dump(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[1].endswith('test_deco.f'))
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'profile.json')
+            self.profiler.save(path)
+            with open(path) as f:
+                self.assertEqual(1, json.load(f)[0]['calls'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
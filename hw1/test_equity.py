@@ -0,0 +1,68 @@
+import itertools
+import unittest
+
+import equity
+import poker
+
+
+class TestEquity(unittest.TestCase):
+    def brute_force(self, players, board):
+        """Shares of players by best_hand on every completion of the board"""
+        deck = sorted(set(poker.CARD_CODES) - set(sum(players, board)))
+        shares = [0.0] * len(players)
+        boards = list(itertools.combinations(deck, 5 - len(board)))
+        for rest in boards:
+            ranks = [poker.hand_rank(poker.best_hand(hole + board + list(rest))) for hole in players]
+            winners = [i for i, rank in enumerate(ranks) if rank == max(ranks)]
+            for i in winners:
+                shares[i] += 1.0 / len(winners)
+        return [share / len(boards) for share in shares]
+
+    def test_showdown(self):
+        stat, exact = equity.calculate([['AS', 'AD'], ['KS', 'KD']], '2C 7H 9D JS 3C'.split())
+        self.assertTrue(exact)
+        self.assertEqual((1.0, 0.0), (stat.get_equity(0)[0], stat.get_equity(1)[0]))
+        stat, _ = equity.calculate([['2S', '3D'], ['2H', '3C']], 'AC KH QD JS 9C'.split())
+        self.assertEqual(([0, 0], [1, 1]), (stat.wins, stat.ties))
+        self.assertEqual((0.5, 0.5, 0.5), stat.get_equity(0))
+
+    def test_exhaustive(self):
+        players, board = [['AS', 'KS'], ['QH', 'QD'], ['7C', '8C']], ['2S', '7S', '9D']
+        expected = self.brute_force(players, board)
+        for workers in (1, 2):
+            stat, exact = equity.calculate(players, board, workers=workers)
+            self.assertTrue(exact)
+            self.assertEqual(43 * 42 / 2, stat.trials)
+            for i, share in enumerate(expected):
+                self.assertAlmostEqual(share, stat.get_equity(i)[0])
+
+    def test_monte_carlo(self):
+        players, board = [['AS', 'KS'], ['QH', 'QD']], ['2S', '7S', '9D']
+        exact_stat, _ = equity.calculate(players, board)
+        stat, exact = equity.calculate(players, board, trials=30000, workers=2, seed=1)
+        self.assertFalse(exact)
+        self.assertEqual(30000, stat.trials)
+        for i in range(2):
+            mean, low, high = stat.get_equity(i, equity.CONFIDENCE_Z[0.99])
+            self.assertTrue(low < exact_stat.get_equity(i)[0] < high)
+            self.assertTrue(low < mean < high)
+        same_stat, _ = equity.calculate(players, board, trials=30000, seed=1)
+        self.assertEqual(stat.shares, same_stat.shares)
+
+    def test_opponents(self):
+        stat, exact = equity.calculate([['AS', 'AD']], opponents=3, trials=2000, seed=1)
+        self.assertFalse(exact)
+        self.assertEqual(4, len(stat.shares))
+        self.assertAlmostEqual(1.0, sum(stat.get_equity(i)[0] for i in range(4)))
+        self.assertTrue(stat.get_equity(0)[0] > 0.5)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, equity.calculate, [['AS', 'AD'], ['AS', 'KD']])
+        self.assertRaises(ValueError, equity.calculate, [['AS', 'AD']])
+        self.assertRaises(ValueError, equity.calculate, [['AS', 'AD', 'KS'], ['QS', 'QD']])
+        self.assertRaises(ValueError, equity.calculate, [['AS', 'AX'], ['QS', 'QD']])
+        self.assertRaises(ValueError, equity.calculate, [['AS', 'AD'], ['QS', 'QD']], ['2S', '7S', '1D'])
+
+
+if __name__ == '__main__':
+    unittest.main()
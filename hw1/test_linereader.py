@@ -0,0 +1,65 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import linereader
+
+
+class TestLineReader(unittest.TestCase):
+    lines = ['line %d %s' % (i, 'x' * (i % 50)) for i in range(5000)]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data, members=1):
+        path = os.path.join(self.tmp_dir, name)
+        if name.endswith('.gz'):
+            step = len(data) // members + 1
+            with open(path, 'wb') as f:
+                for i in range(members):
+                    member = gzip.GzipFile(fileobj=f, mode='wb')
+                    member.write(data[i * step:(i + 1) * step])
+                    member.close()
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path
+
+    def assert_backends(self, path, expected):
+        for backend in sorted(linereader.BACKENDS):
+            lines = [line.rstrip('\n') for line in linereader.read_lines(path, backend, block_size=1000)]
+            self.assertEqual(expected, lines, backend)
+
+    def test_plain(self):
+        self.assert_backends(self.write('log', '\n'.join(self.lines) + '\n'), self.lines)
+
+    def test_gzip(self):
+        self.assert_backends(self.write('log.gz', '\n'.join(self.lines) + '\n'), self.lines)
+
+    def test_gzip_members(self):
+        self.assert_backends(self.write('log.gz', '\n'.join(self.lines) + '\n', members=3), self.lines)
+
+    def test_no_trailing_newline(self):
+        self.assert_backends(self.write('log.gz', '\n'.join(self.lines)), self.lines)
+
+    def test_empty(self):
+        self.assert_backends(self.write('log.gz', ''), [])
+
+    def test_early_close(self):
+        path = self.write('log.gz', '\n'.join(self.lines) + '\n')
+        for backend in sorted(linereader.BACKENDS):
+            lines = linereader.read_lines(path, backend, block_size=100)
+            self.assertEqual(self.lines[0], next(lines).rstrip('\n'))
+            lines.close()
+
+    def test_unknown_backend(self):
+        self.assertRaises(RuntimeError, linereader.read_lines, 'log', 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,497 @@
+import cPickle
+import gzip
+import json
+import math
+import os
+import random
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import log_analyzer
+
+LINE = ('1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET %s HTTP/1.1" 200 927 "-" '
+        '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752759" '
+        '"dc7161be3" %s\n')
+
+
+def make_lines(count, urls=50, seed=42):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        url = '/api/v2/banner/%d' % rnd.randint(1, urls)
+        lines.append(LINE % (url, '%.3f' % rnd.expovariate(5)))
+    return lines
+
+
+def legacy_percentile(lst, p):
+    """percentile as it was computed before the single sort summary"""
+    lst = sorted(lst)
+    index = (p / 100.0) * len(lst)
+    if math.floor(index) == index:
+        result = (lst[int(index)-1] + lst[int(index)]) / 2.0
+    else:
+        result = lst[int(math.floor(index))]
+    return result
+
+
+class LogAnalyzerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_log(self, name, lines):
+        path = os.path.join(self.tmp_dir, name)
+        f = gzip.open(path, 'wb') if name.endswith('.gz') else open(path, 'wb')
+        f.writelines(lines)
+        f.close()
+        return path
+
+    @staticmethod
+    def report(stat):
+        return log_analyzer.get_report(stat.urls, stat.total_count, stat.total_time, 1000)
+
+
+class TestParallel(LogAnalyzerTestCase):
+    def setUp(self):
+        super(TestParallel, self).setUp()
+        self.chunk_bytes = log_analyzer.CONFIG['CHUNK_BYTES']
+        self.chunk_lines = log_analyzer.CONFIG['CHUNK_LINES']
+        log_analyzer.CONFIG['CHUNK_BYTES'] = 4096
+        log_analyzer.CONFIG['CHUNK_LINES'] = 100
+
+    def tearDown(self):
+        log_analyzer.CONFIG['CHUNK_BYTES'] = self.chunk_bytes
+        log_analyzer.CONFIG['CHUNK_LINES'] = self.chunk_lines
+        super(TestParallel, self).tearDown()
+
+    def test_byte_chunks_cover_file(self):
+        lines = make_lines(1000)
+        path = self.write_log('nginx-access-ui.log-20170630', lines)
+        read = []
+        for chunk in log_analyzer.get_byte_chunks(path, 4096):
+            read.extend(log_analyzer.read_byte_chunk(*chunk))
+        self.assertEqual([l.rstrip('\n') for l in lines], read)
+
+    def test_parallel_report_equals_serial(self):
+        lines = make_lines(3000)
+        for name in ('nginx-access-ui.log-20170630', 'nginx-access-ui.log-20170630.gz'):
+            path = self.write_log(name, lines)
+            serial = log_analyzer.collect_stat(log_analyzer.xreadlines(path))
+            parallel = log_analyzer.collect_stat_parallel(path, 3)
+            self.assertEqual(self.report(serial), self.report(parallel))
+
+
+class TestParsers(LogAnalyzerTestCase):
+    malformed_lines = [
+        '',
+        '\n',
+        'garbage line\n',
+        LINE.replace('"GET %s HTTP/1.1"', '"-"') % '0.001',
+        LINE % ('/api/v2/banner/1', '-'),
+        (LINE % ('/api/v2/banner/1', '0.390'))[:100],
+        LINE % ('/api/v2/banner/"quoted"', '0.390'),
+        LINE % ('/api/v2/banner/1 extra', '0.390'),
+        LINE % ('/api/v2/banner/1', '0.390 tail'),
+        (LINE % ('/api/v2/banner/1', '0.390')).replace(' "-" "Lynx', ' "-"\t"Lynx'),
+        (LINE % ('/api/v2/banner/1', '0.390')).replace('-  -', '-  - -'),
+        (LINE % ('/api/v2/banner/1', '0.390')).rstrip('\n'),
+        (LINE % ('/api/v2/banner/1', '0.390')).replace(' 200 927 ', ' 200  927 '),
+        (LINE % ('/api/v2/banner/1', '0.390')).replace(' 200 927 ', ' 200 '),
+    ]
+
+    def test_fast_parser_equals_regex(self):
+        for line in make_lines(2000, urls=500) + self.malformed_lines:
+            self.assertEqual(log_analyzer.parse_line_regex(line), log_analyzer.parse_line_fast(line), line)
+
+    def test_parse_line_dict(self):
+        self.assertEqual({'request_url': '/api/v2/banner/1', 'request_time': 0.39},
+                         log_analyzer.parse_line(LINE % ('/api/v2/banner/1', '0.390')))
+        self.assertIsNone(log_analyzer.parse_line('garbage line\n'))
+
+    def test_fast_parser_report(self):
+        lines = make_lines(1000) + self.malformed_lines
+        config = dict(log_analyzer.CONFIG, PARSER='fast')
+        self.assertEqual(self.report(log_analyzer.collect_stat(lines)),
+                         self.report(log_analyzer.collect_stat(lines, config)))
+
+
+class TestIncremental(LogAnalyzerTestCase):
+    def setUp(self):
+        super(TestIncremental, self).setUp()
+        self.config = dict(log_analyzer.CONFIG, STATE_DIR=os.path.join(self.tmp_dir, 'state'))
+
+    def test_incremental_equals_full_read(self):
+        lines = make_lines(1500)
+        path = self.write_log('nginx-access-ui.log-20170630', lines[:500])
+        log_analyzer.collect_stat_incremental(path, self.config)
+        with open(path, 'ab') as f:
+            f.writelines(lines[500:1000])
+            f.write(lines[1000][:50])
+        stat = log_analyzer.collect_stat_incremental(path, self.config)
+        self.assertEqual(1000, stat.total_count)
+        with open(path, 'ab') as f:
+            f.write(lines[1000][50:])
+            f.writelines(lines[1001:])
+        stat = log_analyzer.collect_stat_incremental(path, self.config)
+        self.assertEqual(self.report(log_analyzer.collect_stat(lines)), self.report(stat))
+        self.assertEqual(os.path.getsize(path), log_analyzer.load_state(
+            log_analyzer.get_state_path(path, self.config))['offset'])
+
+    def test_rotated_log_starts_over(self):
+        lines = make_lines(600)
+        path = self.write_log('nginx-access-ui.log-20170630', lines)
+        log_analyzer.collect_stat_incremental(path, self.config)
+        path = self.write_log('nginx-access-ui.log-20170630', lines[:200])
+        stat = log_analyzer.collect_stat_incremental(path, self.config)
+        self.assertEqual(200, stat.total_count)
+
+    def test_changed_settings_start_over(self):
+        lines = make_lines(600)
+        path = self.write_log('nginx-access-ui.log-20170630', lines)
+        log_analyzer.collect_stat_incremental(path, dict(self.config, NORMALIZE=True))
+        config = dict(self.config, NORMALIZE=True, NORMALIZE_RULES=((r'\d+', '{n}'),))
+        stat = log_analyzer.collect_stat_incremental(path, config)
+        self.assertEqual(600, stat.total_count)
+        self.assertTrue(all('{n}' in url for url in stat.urls))
+
+    def test_same_name_in_other_dir(self):
+        lines = make_lines(600)
+        path = self.write_log('nginx-access-ui.log-20170630', lines[:400])
+        other_dir = os.path.join(self.tmp_dir, 'other')
+        os.mkdir(other_dir)
+        other_path = os.path.join(other_dir, 'nginx-access-ui.log-20170630')
+        with open(other_path, 'wb') as f:
+            f.writelines(lines[400:])
+        self.assertEqual(400, log_analyzer.collect_stat_incremental(path, self.config).total_count)
+        self.assertEqual(200, log_analyzer.collect_stat_incremental(other_path, self.config).total_count)
+        state = log_analyzer.load_state(log_analyzer.get_state_path(path, self.config))
+        self.assertEqual(os.path.getsize(path), state['offset'])
+        self.assertEqual(400, state['stat'].total_count)
+
+
+class TestBatch(LogAnalyzerTestCase):
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.config = dict(log_analyzer.CONFIG, CACHE_DIR=os.path.join(self.tmp_dir, 'cache'))
+        self.lines = make_lines(900)
+        self.paths = [self.write_log('nginx-access-ui.log-2017070%d' % (i + 1), self.lines[i * 300:(i + 1) * 300])
+                      for i in range(3)]
+
+    def test_batch_files_by_dates(self):
+        pattern = os.path.join(self.tmp_dir, 'nginx-access-ui.log-*')
+        self.assertEqual(self.paths, log_analyzer.get_batch_files(pattern))
+        self.assertEqual(self.paths[1:2], log_analyzer.get_batch_files(
+            pattern, log_analyzer.parse_date('20170702'), log_analyzer.parse_date('20170702')))
+
+    def test_batch_equals_single_log(self):
+        self.paths[1] = self.write_log('nginx-access-ui.log-20170702.gz', self.lines[300:600])
+        os.remove(os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170702'))
+        for workers in (1, 2):
+            stat = log_analyzer.collect_stat_batch(self.paths, workers, self.config)
+            self.assertEqual(self.report(log_analyzer.collect_stat(self.lines)), self.report(stat))
+
+    def test_cache_reused_until_file_changed(self):
+        expected = self.report(log_analyzer.collect_stat_batch(self.paths, 1, self.config))
+        collect_stat = log_analyzer.collect_stat
+        parsed = []
+
+        def counted_collect_stat(lines, config=None):
+            parsed.append(lines)
+            return collect_stat(lines, config)
+
+        log_analyzer.collect_stat = counted_collect_stat
+        try:
+            self.assertEqual(expected, self.report(log_analyzer.collect_stat_batch(self.paths, 1, self.config)))
+            self.assertEqual(0, len(parsed))
+            with open(self.paths[2], 'ab') as f:
+                f.writelines(make_lines(10, seed=1))
+            stat = log_analyzer.collect_stat_batch(self.paths, 1, self.config)
+            self.assertEqual(1, len(parsed))
+            self.assertEqual(910, stat.total_count)
+        finally:
+            log_analyzer.collect_stat = collect_stat
+
+    def test_cache_depends_on_stat_settings(self):
+        path = log_analyzer.get_cache_path(self.paths[0], self.config)
+        for name, value in (('TOP_CAPACITY', 100), ('NORMALIZE_RULES', ()), ('BUCKET_TOP_URLS', 5),
+                            ('BUCKET_ACCURACY', 0.1)):
+            config = dict(self.config, **{name: value})
+            self.assertNotEqual(path, log_analyzer.get_cache_path(self.paths[0], config), name)
+        self.assertEqual(path, log_analyzer.get_cache_path(self.paths[0], dict(self.config, REPORT_SIZE=1)))
+
+
+class TestTopUrls(LogAnalyzerTestCase):
+    def test_top_report_equals_full_sort(self):
+        stat = log_analyzer.collect_stat(make_lines(3000, urls=400))
+        full = log_analyzer.get_report(stat.urls, stat.total_count, stat.total_time, len(stat.urls))
+        self.assertEqual(len(stat.urls), len(full))
+        self.assertEqual(sorted(full, key=lambda x: (x['time_perc'], x['time_sum'], x['url']), reverse=True), full)
+        self.assertEqual(full[:25], log_analyzer.get_report(stat.urls, stat.total_count, stat.total_time, 25))
+
+    def test_bounded_capacity_keeps_heavy_urls(self):
+        lines = [LINE % ('/heavy/%d' % (i % 5), '1.000') for i in range(500)]
+        lines += [LINE % ('/rare/%d' % i, '0.001') for i in range(5000)]
+        random.Random(7).shuffle(lines)
+        config = dict(log_analyzer.CONFIG, TOP_CAPACITY=50)
+        stat = log_analyzer.collect_stat(lines, config)
+        self.assertLessEqual(len(stat.urls), 50)
+        self.assertEqual(5500, stat.total_count)
+        exact_stat = log_analyzer.collect_stat(lines)
+        for url, times in stat.urls.iteritems():
+            self.assertLessEqual(sum(exact_stat.urls[url]) - sum(times), stat.evicted_time + 1e-9, url)
+            self.assertAlmostEqual(sum(times), stat.sums[url])
+        exact = self.report(exact_stat)
+        report = self.report(stat)
+        self.assertEqual(['/heavy/%d' % i for i in range(5)], sorted(r['url'] for r in report[:5]))
+        self.assertEqual(exact[:5], report[:5])
+
+    def test_bounded_capacity_merge(self):
+        config = dict(log_analyzer.CONFIG, TOP_CAPACITY=20, SKETCH_ACCURACY=0.01)
+        left = log_analyzer.collect_stat(make_lines(500, urls=100, seed=1), config)
+        right = log_analyzer.collect_stat(make_lines(500, urls=100, seed=2), config)
+        self.assertLessEqual(len(left.merge(right).urls), 20)
+        self.assertEqual(set(left.urls), set(left.sums))
+
+    def test_evicted_again_within_bound(self):
+        # /back is evicted by the rare urls, seen again and evicted again
+        lines = []
+        for i in range(3):
+            lines += [LINE % ('/back', '0.100')] + [LINE % ('/rare/%d/%d' % (i, j), '0.300') for j in range(4)]
+        lines += [LINE % ('/back', '0.100')]
+        stat = log_analyzer.collect_stat(lines, dict(log_analyzer.CONFIG, TOP_CAPACITY=4))
+        self.assertIn('/back', stat.urls)
+        self.assertAlmostEqual(0.1, sum(stat.urls['/back']))
+        self.assertLessEqual(0.4 - 0.1, stat.evicted_time)
+
+
+class TestUrlNormalizer(LogAnalyzerTestCase):
+    def setUp(self):
+        super(TestUrlNormalizer, self).setUp()
+        self.normalize = log_analyzer.UrlNormalizer(log_analyzer.CONFIG['NORMALIZE_RULES'], cache_size=2)
+
+    def test_templates(self):
+        cases = [
+            ('/api/v2/banner/25019354', '/api/v2/banner/{id}'),
+            ('/api/v2/banner/25019354/?a=1&b=2', '/api/v2/banner/{id}/'),
+            ('/api/1/photo/3fa85f64-5717-4562-b3fc-2c963f66afa6#top', '/api/{id}/photo/{uuid}'),
+            ('/export/7c9e6679f4f3a2b1e2c3d4e5f6a7b8c9.csv', '/export/7c9e6679f4f3a2b1e2c3d4e5f6a7b8c9.csv'),
+            ('/export/7c9e6679f4f3a2b1e2c3d4e5f6a7b8c9', '/export/{hash}'),
+            ('/api/v2/group/1a', '/api/v2/group/1a'),
+            ('/', '/'),
+        ]
+        for url, expected in cases:
+            self.assertEqual(expected, self.normalize(url))
+
+    def test_interned_keys(self):
+        key = self.normalize('/api/v2/banner/1')
+        self.normalize('/api/v2/banner/2')
+        self.normalize('/api/v2/banner/3')
+        self.assertIs(key, self.normalize('/api/v2/banner/4'))
+        self.assertLessEqual(len(self.normalize.cache), 2)
+
+    def test_normalized_stat(self):
+        config = dict(log_analyzer.CONFIG, NORMALIZE=True)
+        lines = make_lines(1000, urls=300)
+        stat = log_analyzer.collect_stat(lines, config)
+        self.assertEqual(['/api/v2/banner/{id}'], stat.urls.keys())
+        self.assertEqual(1000, len(stat.urls['/api/v2/banner/{id}']))
+
+
+class TestSaveReport(LogAnalyzerTestCase):
+    def setUp(self):
+        super(TestSaveReport, self).setUp()
+        self.report_rows = self.report(log_analyzer.collect_stat(make_lines(1000)))
+
+    def read(self, name):
+        with open(os.path.join(self.tmp_dir, name)) as f:
+            return f.read()
+
+    def test_json_equals_dump(self):
+        log_analyzer.save_report(iter(self.report_rows), os.path.join(self.tmp_dir, 'report.json'), 'rows')
+        self.assertEqual(json.dumps(self.report_rows), self.read('report.json'))
+
+    def test_html_equals_replace(self):
+        log_analyzer.save_report(self.report_rows, os.path.join(self.tmp_dir, 'report.html'), 'rows')
+        with open('./report.html') as f:
+            expected = f.read().replace('$table_json', json.dumps(self.report_rows))
+        self.assertEqual(expected, self.read('report.html'))
+
+    def test_columnar_json(self):
+        log_analyzer.save_report(self.report_rows, os.path.join(self.tmp_dir, 'report.json'), 'columns')
+        table = json.loads(self.read('report.json'))
+        self.assertEqual(self.report_rows, [dict(zip(table['columns'], row)) for row in table['rows']])
+
+    def test_columnar_html(self):
+        log_analyzer.save_report(self.report_rows, os.path.join(self.tmp_dir, 'report.html'), 'columns')
+        self.assertIn('var table = %s({"columns": ' % log_analyzer.COLUMNS_TO_ROWS_JS, self.read('report.html'))
+
+    def test_empty_columnar(self):
+        log_analyzer.save_report([], os.path.join(self.tmp_dir, 'report.json'), 'columns')
+        self.assertEqual({'columns': [], 'rows': []}, json.loads(self.read('report.json')))
+
+
+class TestSeries(LogAnalyzerTestCase):
+    @staticmethod
+    def make_timed_lines():
+        lines = []
+        for minute in range(12):
+            for i in range(40):
+                line = LINE % ('/api/v2/banner/%d' % (i % (4 + minute)), '%.3f' % (0.1 * (minute + 1)))
+                hour, minute_of_hour = divmod(50 + minute, 60)
+                lines.append(line.replace('03:50:22', '%02d:%02d:%02d' % (3 + hour, minute_of_hour, i)))
+        return lines
+
+    def test_bucketer(self):
+        get_bucket = log_analyzer.TimeBucketer(5)
+        self.assertEqual('2017-06-29 03:50', get_bucket(LINE % ('/', '0.1')))
+        self.assertEqual('2017-06-29 00:00', get_bucket(LINE.replace('03:50:22', '00:04:59') % ('/', '0.1')))
+        self.assertEqual('2017-06-29 00:00', log_analyzer.TimeBucketer(120)(
+            LINE.replace('03:50:22', '01:59:00') % ('/', '0.1')))
+        self.assertIsNone(get_bucket('garbage line'))
+
+    def test_series(self):
+        config = dict(log_analyzer.CONFIG, BUCKET_MINUTES=5, BUCKET_TOP_URLS=3)
+        stat = log_analyzer.collect_stat(self.make_timed_lines(), config)
+        self.assertEqual(['2017-06-29 03:50', '2017-06-29 03:55', '2017-06-29 04:00'], sorted(stat.series))
+        for urls in stat.series.values():
+            self.assertLessEqual(len(urls), 6)
+        series = log_analyzer.get_series_report(stat.series, 3)
+        self.assertEqual(3, len(series))
+        first = series[0]['urls']
+        self.assertEqual(3, len(first))
+        self.assertEqual(sorted(first, key=lambda x: x['time_sum'], reverse=True), first)
+        self.assertIn('time_p95', first[0])
+
+    def test_series_keys_shared(self):
+        config = dict(log_analyzer.CONFIG, BUCKET_MINUTES=1)
+        stat = log_analyzer.collect_stat(self.make_timed_lines(), config)
+        for urls in stat.series.values():
+            for url in urls:
+                self.assertIs(intern(url), url)
+
+    def test_keys_shared_after_unpickling(self):
+        config = dict(log_analyzer.CONFIG, BUCKET_MINUTES=1, TOP_CAPACITY=100)
+        stat = log_analyzer.collect_stat(self.make_timed_lines(), config)
+        loaded = cPickle.loads(cPickle.dumps(stat, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(self.report(stat), self.report(loaded))
+        for urls in [loaded.urls, loaded.sums] + loaded.series.values():
+            for url in urls:
+                self.assertIs(intern(url), url)
+        loaded.urls['/new'].append(1.0)
+        merged = log_analyzer.new_log_stat(config).merge(loaded)
+        for url in merged.urls:
+            self.assertIs(intern(url), url)
+
+    def test_series_merge(self):
+        config = dict(log_analyzer.CONFIG, BUCKET_MINUTES=5, BUCKET_TOP_URLS=100)
+        lines = self.make_timed_lines()
+        single = log_analyzer.collect_stat(lines, config)
+        merged = log_analyzer.collect_stat(lines[:200], config).merge(log_analyzer.collect_stat(lines[200:], config))
+        self.assertEqual(log_analyzer.get_series_report(single.series), log_analyzer.get_series_report(merged.series))
+
+    def test_series_file(self):
+        config = dict(log_analyzer.CONFIG)
+        log_analyzer.CONFIG.update(BUCKET_MINUTES=5)
+        try:
+            stat = log_analyzer.collect_stat(self.make_timed_lines())
+            report_path = os.path.join(self.tmp_dir, 'report-2017.06.29.json')
+            self.assertTrue(log_analyzer.save_stat_report(stat, report_path))
+        finally:
+            log_analyzer.CONFIG.update(config)
+        with open(os.path.join(self.tmp_dir, 'report-2017.06.29.series.json')) as f:
+            self.assertEqual(3, len(json.load(f)))
+
+
+class TestPercentiles(LogAnalyzerTestCase):
+    def test_summary_equals_separate_passes(self):
+        rnd = random.Random(3)
+        for size in (1, 2, 3, 10, 101):
+            times = [round(rnd.random(), 3) for _ in range(size)]
+            count, time_sum, time_max, values = log_analyzer.get_times_summary(times, (50, 95, 99))
+            self.assertEqual((len(times), sum(times), max(times)), (count, time_sum, time_max))
+            self.assertEqual([legacy_percentile(times, p) for p in (50, 95, 99)], values)
+
+    def test_edge_percentiles(self):
+        self.assertEqual(3, log_analyzer.percentile([1, 3], 100))
+        self.assertEqual(1, log_analyzer.percentile([1, 3], 0))
+
+    def test_configured_percentiles(self):
+        stat = log_analyzer.collect_stat(make_lines(200))
+        report = log_analyzer.get_report(stat.urls, stat.total_count, stat.total_time, 10, (75, 90))
+        self.assertIn('time_p75', report[0])
+        self.assertIn('time_p90', report[0])
+        self.assertNotIn('time_p50', report[0])
+
+
+class TestTimeSketch(LogAnalyzerTestCase):
+    def test_percentiles_within_accuracy(self):
+        rnd = random.Random(1)
+        times = [round(rnd.expovariate(5), 3) for _ in range(10000)]
+        sketch = log_analyzer.TimeSketch(0.01)
+        for t in times:
+            sketch.append(t)
+        self.assertEqual(len(times), sketch.count)
+        self.assertEqual(max(times), sketch.max)
+        self.assertAlmostEqual(sum(times), sketch.sum)
+        for p in (50, 95, 99):
+            exact = log_analyzer.percentile(times, p)
+            self.assertLessEqual(abs(sketch.percentile(p) - exact), exact * 0.01 + 1e-9)
+
+    def test_merge_equals_single_sketch(self):
+        times = [0, 0.001, 0.5, 0.25, 12.0, 0.75, 0.3]
+        single = log_analyzer.TimeSketch(0.02)
+        left, right = log_analyzer.TimeSketch(0.02), log_analyzer.TimeSketch(0.02)
+        for i, t in enumerate(times):
+            single.append(t)
+            (left if i % 2 else right).append(t)
+        merged = left.merge(right)
+        self.assertEqual(single.buckets, merged.buckets)
+        self.assertEqual(single.zero_count, merged.zero_count)
+        self.assertEqual(single.percentile(50), merged.percentile(50))
+
+    def test_collapse_bounds_buckets(self):
+        sketch = log_analyzer.TimeSketch(0.01, max_buckets=16)
+        for i in range(1, 1000):
+            sketch.append(i / 10.0)
+        self.assertLessEqual(len(sketch.buckets), 16)
+        self.assertEqual(999, sketch.count)
+
+    def test_sketch_report(self):
+        config = dict(log_analyzer.CONFIG, SKETCH_ACCURACY=0.01)
+        lines = make_lines(2000)
+        exact = self.report(log_analyzer.collect_stat(lines))
+        approx = self.report(log_analyzer.collect_stat(lines, config))
+        exact, approx = dict((r['url'], r) for r in exact), dict((r['url'], r) for r in approx)
+        self.assertEqual(sorted(exact), sorted(approx))
+        for url, row in exact.items():
+            for key in ('count', 'time_max', 'time_sum', 'count_perc'):
+                self.assertEqual(row[key], approx[url][key])
+            self.assertLessEqual(abs(row['time_p95'] - approx[url]['time_p95']), row['time_p95'] * 0.01 + 0.001)
+
+    def test_parallel_sketch(self):
+        config = dict(log_analyzer.CONFIG, SKETCH_ACCURACY=0.01, CHUNK_BYTES=4096)
+        path = self.write_log('nginx-access-ui.log-20170630', make_lines(2000))
+        serial = log_analyzer.collect_stat(log_analyzer.xreadlines(path), config)
+        parallel = log_analyzer.collect_stat_parallel(path, 2, config)
+        self.assertEqual([r['time_p99'] for r in self.report(serial)], [r['time_p99'] for r in self.report(parallel)])
+
+    def test_accuracy_argument(self):
+        self.assertEqual(0.01, log_analyzer.parse_accuracy('0.01'))
+        for value in ('0', '1', '1.5', '-0.1', 'nan', 'x'):
+            self.assertRaises(log_analyzer.argparse.ArgumentTypeError, log_analyzer.parse_accuracy, value)
+        argv, stderr = sys.argv, sys.stderr
+        sys.argv, sys.stderr = ['log_analyzer.py', '-s', '1.5'], StringIO.StringIO()
+        try:
+            self.assertRaises(SystemExit, log_analyzer.parse_args)
+            self.assertIn('Accuracy `1.5`', sys.stderr.getvalue())
+        finally:
+            sys.argv, sys.stderr = argv, stderr
+
+
+if __name__ == '__main__':
+    unittest.main()
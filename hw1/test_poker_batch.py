@@ -0,0 +1,52 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import poker
+import poker_batch
+
+
+class TestPokerBatch(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        deck = sorted(poker.CARD_CODES)
+        self.hands = [' '.join(rnd.sample(deck, rnd.choice((5, 6, 7)))) for _ in range(500)]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_rank_hands(self):
+        expected = [(poker.best_hand(hand.split()), poker.best_value(hand.split())) for hand in self.hands]
+        for workers in (1, 3):
+            results = list(poker_batch.rank_hands(iter(self.hands), workers, chunk_size=7))
+            self.assertEqual(expected, results)
+
+    def test_rank_file(self):
+        path = os.path.join(self.tmp_dir, 'hands.gz')
+        f = gzip.open(path, 'wb')
+        f.write('\n'.join(self.hands[:10] + ['', self.hands[10]]) + '\n')
+        f.close()
+        results = list(poker_batch.rank_file(path, workers=2, chunk_size=3))
+        self.assertEqual(12, len(results))
+        self.assertIsNone(results[10])
+        self.assertEqual(poker.best_hand(self.hands[10].split()), results[11][0])
+        text = ''.join(poker_batch.map_chunks(poker_batch.format_chunk, self.hands[:10] + [''], 2, 4))
+        self.assertEqual([poker_batch.format_result(result) for result in results[:11]], text.splitlines())
+
+    def test_invalid(self):
+        for hand in ('AS KS QS JS', 'AS KS QS JS 1S', 'AS KS QS JS TS 9S 8S 7S'):
+            self.assertRaises(ValueError, list, poker_batch.rank_hands(self.hands[:5] + [hand], workers=2))
+
+    def test_duplicate_cards(self):
+        for hand in ('AS AS AS AS AS', 'AS KS QS JS TS 2D 2D'):
+            with self.assertRaises(ValueError) as context:
+                poker_batch.rank_chunk([hand])
+            self.assertIn('Duplicate card %s' % hand.split()[-1], str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
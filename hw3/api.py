@@ -82,6 +82,7 @@
 # Deadline: следующее занятие
 
 import json
+import functools
 import random
 import logging
 import hashlib
@@ -90,7 +91,8 @@ import re
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
 from optparse import OptionParser
-from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from server import SERVERS, KeepAliveHandler, serve
+from store import Store, RedisBackend
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -116,6 +118,9 @@ GENDERS = {
     MALE: "male",
     FEMALE: "female",
 }
+SCORE_TTL = 60 * 60
+# scores are cached in the process only, handlers sharing a remote backend pass their own store
+STORE = Store()
 
 
 # -------------------------------------------------- Field classes --------------------------------------------------- #
@@ -123,9 +128,14 @@ GENDERS = {
 class AbstractField(object):
     __metaclass__ = ABCMeta
 
+    # fields are validated in order of declaration
+    creation_counter = 0
+
     def __init__(self, required=False, nullable=False):
         self.required = required
         self.nullable = nullable
+        self.creation_counter = AbstractField.creation_counter
+        AbstractField.creation_counter += 1
 
     @abstractmethod
     def parse_and_validate(self, value):
@@ -147,23 +157,35 @@ class ArgumentsField(AbstractField):
 
 
 class EmailField(AbstractField):
+    pattern = re.compile(r'(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)')
+
     def parse_and_validate(self, value):
-        if not re.match(r'(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)', str(value)):
+        if not self.pattern.match(value if isinstance(value, basestring) else str(value)):
             raise ValueError('Email address is not valid.')
         return value
 
 
 class PhoneField(AbstractField):
+    pattern = re.compile(r'(^7[\d]{10}$)')
+
     def parse_and_validate(self, value):
-        if not re.match(r'(^7[\d]{10}$)', str(value)):
+        if not self.pattern.match(value if isinstance(value, basestring) else str(value)):
             raise ValueError('Phone is not valid.')
         return value
 
 
 class DateField(AbstractField):
+    # common DD.MM.YYYY dates are parsed without strptime, the rest are left to it
+    pattern = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})\Z')
+
     def parse_and_validate(self, value):
+        match = self.pattern.match(value) if isinstance(value, basestring) else None
         try:
-            value = datetime.strptime(value, '%d.%m.%Y')
+            if match:
+                day, month, year = match.groups()
+                value = datetime(int(year), int(month), int(day))
+            else:
+                value = datetime.strptime(value, '%d.%m.%Y')
         except Exception:
             raise ValueError('Date is not valid.')
         return value
@@ -197,8 +219,17 @@ class ClientIDsField(AbstractField):
 
 # -------------------------------------------------- Request classes ------------------------------------------------- #
 
+# value decoded from json is in Request.empty_values if it is None or empty value of these types
+EMPTY_TYPES = (basestring, list, dict, tuple)
+
+
 class MetaRequest(type):
-    """Metaclass for request entities with validated fields"""
+    """
+    Metaclass for request entities with validated fields. Validation plan is
+    built once per class: tuple of (name, field, required, nullable, parse)
+    in order of fields declaration, so clean does not look up field attributes
+    on each request.
+    """
 
     def __init__(cls, name, bases, attr_dict):
         super(MetaRequest, cls).__init__(name, bases, attr_dict)
@@ -207,6 +238,10 @@ class MetaRequest(type):
             if isinstance(attr, AbstractField):
                 attr.name = key
                 cls.fields.append(attr)
+        cls.fields.sort(key=lambda field: field.creation_counter)
+        cls.field_names = tuple(field.name for field in cls.fields)
+        cls.plan = tuple((field.name, field, field.required, field.nullable, field.parse_and_validate)
+                         for field in cls.fields)
 
 
 class Request(object):
@@ -220,23 +255,25 @@ class Request(object):
         self.request = request
 
     def clean(self):
-        for field in self.fields:
-            value = None
+        errors = self._errors
+        request = self.request
+        for name, field, required, nullable, parse in self.plan:
             try:
-                value = self.request[field.name]
+                value = request[name]
             except (KeyError, TypeError):
-                if field.required:
-                    self._errors.append(self.error_str(field, 'Field is required.'))
+                if required:
+                    errors.append(self.error_str(field, 'Field is required.'))
                     continue
-            if value in self.empty_values and not field.nullable:
-                self._errors.append(self.error_str(field, 'Field not be nullable.'))
+                value = None
+            if value is None or (not value and isinstance(value, EMPTY_TYPES)):
+                if not nullable:
+                    errors.append(self.error_str(field, 'Field not be nullable.'))
+                continue
             try:
-                if value not in self.empty_values:
-                    value = field.parse_and_validate(value)
-                    setattr(self, field.name, value)
+                setattr(self, name, parse(value))
             except ValueError as e:
-                self._errors.append(self.error_str(field, e))
-        return self._errors
+                errors.append(self.error_str(field, e))
+        return errors
 
     def is_valid(self):
         if self._has_errors:
@@ -247,11 +284,7 @@ class Request(object):
         return ', '.join(self._errors)
 
     def get_not_empty_fields(self):
-        fields = []
-        for field in self.fields:
-            if field.name in self.request not in self.empty_values:
-                fields.append(field.name)
-        return fields
+        return [name for name in self.field_names if name in self.request]
 
     @staticmethod
     def error_str(field, message):
@@ -277,6 +310,20 @@ class OnlineScoreRequest(Request):
     birthday = BirthDayField(required=False, nullable=True)
     gender = GenderField(required=False, nullable=True)
 
+    def get_score_key(self):
+        """Key of the score in store made of validated identity fields, absent and empty ones are blank"""
+        values = []
+        for name in self.field_names:
+            value = self.__dict__.get(name)
+            if value is None:
+                value = ''
+            elif isinstance(value, datetime):
+                value = value.strftime('%Y%m%d')
+            elif isinstance(value, unicode):
+                value = value.encode('utf-8')
+            values.append(str(value))
+        return 'score:' + hashlib.md5('\x00'.join(values)).hexdigest()
+
     def clean(self):
         self._errors = super(OnlineScoreRequest, self).clean()
         not_empty_fields = set(self.get_not_empty_fields())
@@ -303,9 +350,10 @@ class MethodRequest(Request):
 class AbstractRequestHandler(object):
     __metaclass__ = ABCMeta
 
-    def __init__(self, request, ctx):
+    def __init__(self, request, ctx, store):
         self.request = request
         self.ctx = ctx
+        self.store = store
 
     @abstractmethod
     def init_request(self, data):
@@ -330,7 +378,7 @@ class OnlineScoreRequestHandler(AbstractRequestHandler):
         self.ctx['has'] = request_type.get_not_empty_fields()
         if self.request.is_admin:
             return {'score': 42}, OK
-        return {'score': random.randrange(0, 100)}, OK
+        return {'score': get_score(self.store, request_type)}, OK
 
 
 class ClientsInterestsRequestHandler(AbstractRequestHandler):
@@ -346,6 +394,24 @@ class ClientsInterestsRequestHandler(AbstractRequestHandler):
 
 # ------------------------------------------------ Base homework part ------------------------------------------------ #
 
+def compute_score(request_type):
+    return random.randrange(0, 100)
+
+
+def get_score(store, request_type):
+    """Score from the store, computed and saved there if it is missing or the store is unavailable"""
+    key = request_type.get_score_key()
+    score = store.cache_get(key)
+    if score is not None:
+        try:
+            return json.loads(score)
+        except ValueError:
+            logging.info('Malformed score %r in store, computing it again' % score)
+    score = compute_score(request_type)
+    store.cache_set(key, json.dumps(score), SCORE_TTL)
+    return score
+
+
 def check_auth(request):
     if request.login == ADMIN_LOGIN:
         digest = hashlib.sha512(datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).hexdigest()
@@ -356,7 +422,7 @@ def check_auth(request):
     return False
 
 
-def method_handler(request, ctx):
+def method_handler(request, ctx, store=STORE):
     handlers = {
         'online_score': OnlineScoreRequestHandler,
         'clients_interests': ClientsInterestsRequestHandler
@@ -376,10 +442,10 @@ def method_handler(request, ctx):
     if request.method not in handlers:
         return None, NOT_FOUND
 
-    return handlers[request.method](request, ctx).run_processing(request.arguments)
+    return handlers[request.method](request, ctx, store).run_processing(request.arguments)
 
 
-class MainHTTPHandler(BaseHTTPRequestHandler):
+class MainHTTPHandler(KeepAliveHandler):
     router = {
         "method": method_handler
     }
@@ -409,29 +475,43 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
             else:
                 code = NOT_FOUND
 
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
         if code not in ERRORS:
             r = {"response": response, "code": code}
         else:
             r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
         context.update(r)
         logging.info(context)
-        self.wfile.write(json.dumps(r))
+        body = json.dumps(r)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", len(body))
+        if code == BAD_REQUEST:
+            # body of the request may be left unread, so the connection can't be reused
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
         return
 
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-m", "--mode", action="store", type="choice", choices=sorted(SERVERS), default="threaded",
+                  help="threaded: thread per connection, event: single thread epoll loop")
+    op.add_option("-w", "--workers", action="store", type=int, default=1,
+                  help="count of pre-forked processes sharing the port with SO_REUSEPORT")
+    op.add_option("-s", "--store", action="store", default=None, help="HOST:PORT of redis shared by workers")
     (opts, args) = op.parse_args()
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
+    handler_class = MainHTTPHandler
+    if opts.store:
+        host, _, port = opts.store.rpartition(':')
+        redis_store = Store(RedisBackend(host or 'localhost', int(port)))
+
+        class RedisStoreHTTPHandler(MainHTTPHandler):
+            router = {
+                "method": functools.partial(method_handler, store=redis_store)
+            }
+        handler_class = RedisStoreHTTPHandler
+    serve(opts.mode, ("localhost", opts.port), handler_class, opts.workers)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks of scoring API.
+#
+# handler - method_handler requests/s with validation plans against the previous field by field validation
+# load    - HTTP load of a local server over keep-alive connections: requests/s, p50 and p99 latency
+#
+# $ python api_bench.py handler -n 100000
+# $ python api_bench.py load -n 20000 -c 16 -m event -w 4
+
+import hashlib
+import httplib
+import json
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from optparse import OptionParser
+
+import api
+
+REQUESTS = {
+    'online_score': {
+        "account": "horns&hoofs", "login": "h&f", "method": "online_score",
+        "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "a", "last_name": "b",
+                      "birthday": "01.01.1990", "gender": 1},
+    },
+    'invalid_score': {
+        "account": "horns&hoofs", "login": "h&f", "method": "online_score",
+        "arguments": {"phone": "89175002040", "email": "stupnikovotus.ru", "gender": "1"},
+    },
+    'clients_interests': {
+        "account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+        "arguments": {"client_ids": [1, 2, 3, 4], "date": "20.07.2017"},
+    },
+}
+
+
+def clean_legacy(self):
+    """Request.clean as it was before validation plans"""
+    for field in self.fields:
+        value = None
+        try:
+            value = self.request[field.name]
+        except (KeyError, TypeError):
+            if field.required:
+                self._errors.append(self.error_str(field, 'Field is required.'))
+                continue
+        if value in self.empty_values and not field.nullable:
+            self._errors.append(self.error_str(field, 'Field not be nullable.'))
+        try:
+            if value not in self.empty_values:
+                value = field.parse_and_validate(value)
+                setattr(self, field.name, value)
+        except ValueError as e:
+            self._errors.append(self.error_str(field, e))
+    return self._errors
+
+
+def get_not_empty_fields_legacy(self):
+    fields = []
+    for field in self.fields:
+        if field.name in self.request not in self.empty_values:
+            fields.append(field.name)
+    return fields
+
+
+def email_legacy(self, value):
+    if not re.match(r'(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)', str(value)):
+        raise ValueError('Email address is not valid.')
+    return value
+
+
+def phone_legacy(self, value):
+    if not re.match(r'(^7[\d]{10}$)', str(value)):
+        raise ValueError('Phone is not valid.')
+    return value
+
+
+def date_legacy(self, value):
+    try:
+        value = datetime.strptime(value, '%d.%m.%Y')
+    except Exception:
+        raise ValueError('Date is not valid.')
+    return value
+
+
+class Legacy(object):
+    """Context manager swapping validation of api with the previous implementation"""
+    patches = (
+        (api.Request, 'clean', clean_legacy),
+        (api.Request, 'get_not_empty_fields', get_not_empty_fields_legacy),
+        (api.EmailField, 'parse_and_validate', email_legacy),
+        (api.PhoneField, 'parse_and_validate', phone_legacy),
+        (api.DateField, 'parse_and_validate', date_legacy),
+    )
+
+    def __enter__(self):
+        self.saved = [(cls, name, cls.__dict__[name]) for cls, name, _ in self.patches]
+        for cls, name, func in self.patches:
+            setattr(cls, name, func)
+
+    def __exit__(self, *args):
+        for cls, name, func in self.saved:
+            setattr(cls, name, func)
+
+
+def sign(request):
+    request = dict(request)
+    request["token"] = hashlib.sha512(request["account"] + request["login"] + api.SALT).hexdigest()
+    return request
+
+
+def run_requests(request, count):
+    started = time.time()
+    for _ in xrange(count):
+        api.method_handler({"body": request, "headers": {}}, {})
+    return time.time() - started
+
+
+def bench_handler(count):
+    print 'method_handler, requests/s (best of 3 x %d requests):' % count
+    for name, request in sorted(REQUESTS.items()):
+        request = sign(request)
+        with Legacy():
+            legacy_time = min(run_requests(request, count) for _ in range(3))
+        plan_time = min(run_requests(request, count) for _ in range(3))
+        print '%-18s %8d -> %8d (x%.2f)' % (name, count / legacy_time, count / plan_time, legacy_time / plan_time)
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(port, mode, workers):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api.py')
+    devnull = open(os.devnull, 'w')
+    process = subprocess.Popen([sys.executable, path, '-p', str(port), '-m', mode, '-w', str(workers),
+                                '-l', os.devnull], stderr=devnull)
+    devnull.close()
+    for _ in range(100):
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return process
+        except socket.error:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Server is not started at port %d' % port)
+
+
+def load_connection((port, count, seed)):
+    """Latencies of `count` requests over a single keep-alive connection"""
+    bodies = [json.dumps(sign(request)) for _, request in sorted(REQUESTS.items())]
+    connection = httplib.HTTPConnection('localhost', port)
+    latencies = []
+    for i in xrange(seed, seed + count):
+        started = time.time()
+        connection.request('POST', '/method/', bodies[i % len(bodies)])
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.time() - started)
+        if response.status != api.OK and response.status != api.INVALID_REQUEST:
+            raise RuntimeError('Unexpected response status %d' % response.status)
+    connection.close()
+    return latencies
+
+
+def get_percentile(values, percent):
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+def bench_load(count, connections, port, mode, workers):
+    process = None
+    if port is None:
+        port = get_free_port()
+        process = start_server(port, mode, workers)
+    pool = multiprocessing.Pool(connections)
+    try:
+        tasks = [(port, count // connections + (i < count % connections), i) for i in range(connections)]
+        started = time.time()
+        latencies = sorted(sum(pool.map(load_connection, tasks), []))
+        elapsed = time.time() - started
+    finally:
+        pool.terminate()
+        pool.join()
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+    server = 'localhost:%d' % port if process is None else '%s server, %d workers' % (mode, workers)
+    print '%s, %d connections: %d requests in %.3f s' % (server, connections, len(latencies), elapsed)
+    print 'requests/s %8d' % (len(latencies) / elapsed)
+    print 'p50 ms     %8.2f' % (get_percentile(latencies, 50) * 1000)
+    print 'p99 ms     %8.2f' % (get_percentile(latencies, 99) * 1000)
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage='%prog [handler|load] [options]')
+    op.add_option("-n", "--requests", action="store", type=int, default=100000)
+    op.add_option("-c", "--connections", action="store", type=int, default=8, help="concurrent clients of load")
+    op.add_option("-p", "--port", action="store", type=int, default=None,
+                  help="load a running server instead of starting one")
+    op.add_option("-m", "--mode", action="store", type="choice", choices=sorted(api.SERVERS), default="threaded")
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    (opts, args) = op.parse_args()
+    bench = args[0] if args else 'handler'
+    if bench == 'handler':
+        bench_handler(opts.requests)
+    elif bench == 'load':
+        bench_load(opts.requests, opts.connections, opts.port, opts.mode, opts.workers)
+    else:
+        op.error('Unexpected benchmark %s' % bench)
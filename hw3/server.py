@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+# Concurrent serving of BaseHTTPRequestHandler subclasses with HTTP/1.1 keep-alive:
+#
+# threaded - thread per connection
+# event    - single thread epoll loop, complete requests are handled one by one
+#
+# Both run in several pre-forked processes if workers > 1, each process binds own
+# socket with SO_REUSEPORT and the kernel balances connections between them.
+# SIGTERM and SIGINT stop accepting connections, accepted requests are completed.
+
+import BaseHTTPServer
+import SocketServer
+import StringIO
+import errno
+import logging
+import multiprocessing
+import select
+import signal
+import socket
+import threading
+import time
+
+KEEPALIVE_TIMEOUT = 5
+POLL_INTERVAL = 0.5
+REQUEST_QUEUE_SIZE = 1024
+BUFFER_SIZE = 64 * 1024
+MAX_HEAD_SIZE = 64 * 1024
+HTTP_HEAD_TERMINATOR = '\r\n\r\n'
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP/1.1 handler: connection is kept alive until client closes it, it is idle
+    for KEEPALIVE_TIMEOUT seconds or server is stopping. Responses must have Content-Length."""
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # response is flushed at once after the request, small writes of status, headers and body
+    # would wait for delayed ACK of the client on a kept alive connection
+    wbufsize = -1
+
+    def end_headers(self):
+        if self.server.stopping.is_set() and not self.close_connection:
+            self.send_header('Connection', 'close')
+        BaseHTTPServer.BaseHTTPRequestHandler.end_headers(self)
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, server_address, handler_class, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.stopping = threading.Event()
+        self.threads = {}
+        self.threads_lock = threading.Lock()
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, handler_class)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        BaseHTTPServer.HTTPServer.server_bind(self)
+
+    def process_request_thread(self, request, client_address):
+        thread = threading.current_thread()
+        with self.threads_lock:
+            self.threads[thread] = request
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self.threads_lock:
+                del self.threads[thread]
+
+    def stop(self):
+        """Request stop, safe to call from signal handler while serve_forever is running"""
+        if not self.stopping.is_set():
+            self.stopping.set()
+            threading.Thread(target=self.shutdown).start()
+
+    def close(self, timeout=KEEPALIVE_TIMEOUT + 1):
+        """
+        Close listening socket and wait for handlers of accepted connections. Their reading
+        side is shut down, so handlers waiting for the next request on kept alive connections
+        exit at once, while the requests already received are completed.
+        """
+        self.server_close()
+        deadline = time.time() + timeout
+        with self.threads_lock:
+            threads = self.threads.items()
+        for thread, request in threads:
+            try:
+                request.shutdown(socket.SHUT_RD)
+            except socket.error:
+                pass
+        for thread, request in threads:
+            thread.join(max(deadline - time.time(), 0))
+
+
+class Connection(object):
+    __slots__ = ('sock', 'address', 'input', 'output', 'close', 'active')
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.input = ''
+        self.output = ''
+        self.close = False
+        self.active = time.time()
+
+    def pop_request(self):
+        """Return the first request if it is read completely"""
+        head_end = self.input.find(HTTP_HEAD_TERMINATOR)
+        if head_end < 0:
+            if len(self.input) > MAX_HEAD_SIZE:
+                raise ValueError('Request head is too large')
+            return None
+        length = 0
+        for line in self.input[:head_end].split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        request_end = head_end + len(HTTP_HEAD_TERMINATOR) + length
+        if len(self.input) < request_end:
+            return None
+        request, self.input = self.input[:request_end], self.input[request_end:]
+        return request
+
+
+def buffered_handler(handler_class):
+    """Handler class running on a request read into memory, response is written into memory too"""
+    class BufferedHandler(handler_class):
+        def setup(self):
+            self.rfile = StringIO.StringIO(self.request)
+            self.wfile = StringIO.StringIO()
+
+        def handle(self):
+            self.close_connection = 1
+            self.handle_one_request()
+
+        def finish(self):
+            pass
+    return BufferedHandler
+
+
+class EventHTTPServer(object):
+    """Single thread server: sockets are read and written without blocking, complete requests
+    are handled in the loop, so slow handlers delay others, but slow clients do not"""
+
+    def __init__(self, server_address, handler_class, reuse_port=False):
+        self.handler_class = buffered_handler(handler_class)
+        self.stopping = threading.Event()
+        self.connections = {}
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(REQUEST_QUEUE_SIZE)
+        self.socket.setblocking(0)
+        self.server_address = self.socket.getsockname()
+        self.epoll = select.epoll()
+        self.epoll.register(self.socket.fileno(), select.EPOLLIN)
+
+    def serve_forever(self):
+        listening = True
+        while listening or self.connections:
+            if listening and self.stopping.is_set():
+                self.epoll.unregister(self.socket.fileno())
+                self.socket.close()
+                listening = False
+            try:
+                events = self.epoll.poll(POLL_INTERVAL)
+            except IOError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                if listening and fd == self.socket.fileno():
+                    self.accept()
+                elif event & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+                    self.read(self.connections[fd])
+                elif event & select.EPOLLOUT:
+                    self.write(self.connections[fd])
+            self.close_idle()
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(0)
+            self.connections[sock.fileno()] = Connection(sock, address)
+            self.epoll.register(sock.fileno(), select.EPOLLIN)
+
+    def read(self, connection):
+        try:
+            data = connection.sock.recv(BUFFER_SIZE)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            return self.disconnect(connection)
+        connection.input += data
+        connection.active = time.time()
+        try:
+            request = connection.pop_request()
+            while request is not None and not connection.close:
+                response, close = self.handle(request, connection.address)
+                connection.output += response
+                connection.close = bool(close)
+                request = connection.pop_request()
+        except ValueError as e:
+            logging.info('Bad request from %s: %s' % (connection.address, e))
+            return self.disconnect(connection)
+        if connection.output:
+            self.write(connection)
+        elif connection.close:
+            self.disconnect(connection)
+
+    def handle(self, request, client_address):
+        try:
+            handler = self.handler_class(request, client_address, self)
+        except Exception as e:
+            logging.exception('Unexpected error: %s' % e)
+            return '', True
+        return handler.wfile.getvalue(), handler.close_connection
+
+    def write(self, connection):
+        try:
+            sent = connection.sock.send(connection.output)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                sent = 0
+            else:
+                return self.disconnect(connection)
+        connection.output = connection.output[sent:]
+        connection.active = time.time()
+        if connection.output:
+            self.epoll.modify(connection.sock.fileno(), select.EPOLLOUT)
+        elif connection.close:
+            self.disconnect(connection)
+        else:
+            self.epoll.modify(connection.sock.fileno(), select.EPOLLIN)
+
+    def close_idle(self):
+        now = time.time()
+        for connection in self.connections.values():
+            idle = not connection.output and not connection.input
+            if (idle and self.stopping.is_set()) or now - connection.active > KEEPALIVE_TIMEOUT:
+                self.disconnect(connection)
+
+    def disconnect(self, connection):
+        fd = connection.sock.fileno()
+        self.epoll.unregister(fd)
+        del self.connections[fd]
+        connection.sock.close()
+
+    def stop(self):
+        self.stopping.set()
+
+    def close(self):
+        if not self.stopping.is_set():
+            self.stopping.set()
+            self.socket.close()
+        self.epoll.close()
+
+
+SERVERS = {
+    'threaded': ThreadedHTTPServer,
+    'event': EventHTTPServer,
+}
+
+
+def run_server(mode, server_address, handler_class, reuse_port=False):
+    """Serve until SIGTERM or SIGINT, then stop accepting connections and complete accepted requests"""
+    server = SERVERS[mode](server_address, handler_class, reuse_port)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: server.stop())
+    logging.info('Starting %s server at %s:%d' % ((mode,) + server.server_address))
+    server.serve_forever()
+    server.close()
+    logging.info('Server at %s:%d is stopped' % server.server_address)
+
+
+def serve(mode, server_address, handler_class, workers=1):
+    if workers <= 1:
+        return run_server(mode, server_address, handler_class)
+    processes = [multiprocessing.Process(target=run_server, args=(mode, server_address, handler_class, True))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, stop)
+    for process in processes:
+        process.join()
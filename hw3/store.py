@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# Store of the scoring API: in-process LRU cache with TTL in front of a key-value backend.
+#
+# MemoryBackend - backend in the process memory, stand-in of a remote one for tests and single process runs
+# RedisBackend  - remote backend speaking redis protocol over a socket with timeouts, no client library needed
+#
+# Store.cache_get and Store.cache_set are for values which can be computed again: failures of the backend
+# are retried, then logged and the store is treated as empty, so callers degrade to computing the value.
+# Store.get is for values which can't be computed, it raises StoreError when the backend is unavailable.
+
+import collections
+import logging
+import socket
+import threading
+import time
+
+CACHE_SIZE = 10000
+CACHE_TTL = 60 * 60
+# values read from the backend are kept in the process at most for that long, so they do not
+# outlive the backend copy much
+LOCAL_TTL = 60
+TIMEOUT = 0.1
+RETRIES = 3
+RETRY_DELAY = 0.01
+# backend is not requested by cache_get and cache_set for a while after it failed all retries
+BACKOFF = 5
+
+
+class StoreError(Exception):
+    pass
+
+
+class LRUCache(object):
+    """Thread-safe cache of at most `maxsize` values, each expires in its own ttl seconds"""
+
+    def __init__(self, maxsize=CACHE_SIZE, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, expires = self.items.pop(key)
+            except KeyError:
+                return None
+            if expires < self.clock():
+                return None
+            self.items[key] = value, expires
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value, self.clock() + ttl
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class MemoryBackend(object):
+    """Key-value backend in the process memory, interface of remote backends"""
+
+    def __init__(self, clock=time.time):
+        self.items = {}
+        self.lock = threading.Lock()
+        self.clock = clock
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.items.get(key, (None, None))
+            if expires is not None and expires < self.clock():
+                del self.items[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.items[key] = value, self.clock() + ttl if ttl else None
+
+
+class RedisBackend(object):
+    """String values in redis, a connection per thread is opened on demand and reopened after errors"""
+
+    def __init__(self, host='localhost', port=6379, timeout=TIMEOUT):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.execute('SET', key, value, 'EX', int(ttl))
+        else:
+            self.execute('SET', key, value)
+
+    def execute(self, *args):
+        connection = getattr(self.local, 'connection', None)
+        try:
+            if connection is None:
+                connection = self.local.connection = socket.create_connection(self.address, self.timeout)
+                self.local.file = connection.makefile('rb')
+            connection.sendall(self.encode(args))
+            return self.read_reply(self.local.file)
+        except (socket.error, StoreError) as e:
+            self.disconnect()
+            raise StoreError('Redis %s:%d: %s' % (self.address + (e,)))
+
+    def disconnect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            self.local.file.close()
+            connection.close()
+        self.local.connection = self.local.file = None
+
+    @staticmethod
+    def encode(args):
+        args = [arg.encode('utf-8') if isinstance(arg, unicode) else str(arg) for arg in args]
+        return '*%d\r\n' % len(args) + ''.join('$%d\r\n%s\r\n' % (len(arg), arg) for arg in args)
+
+    @staticmethod
+    def read_reply(f):
+        line = f.readline()
+        if not line.endswith('\r\n'):
+            raise StoreError('Connection is closed')
+        kind, data = line[0], line[1:-2]
+        if kind == '-':
+            raise StoreError(data)
+        if kind == '$':
+            try:
+                length = int(data)
+            except ValueError:
+                raise StoreError('Unexpected reply %r' % line)
+            if length < 0:
+                return None
+            value = f.read(length + 2)
+            if len(value) < length + 2:
+                raise StoreError('Connection is closed')
+            return value[:-2]
+        if kind in '+:':
+            return data
+        raise StoreError('Unexpected reply %r' % line)
+
+
+class Store(object):
+    def __init__(self, backend=None, cache=None, retries=RETRIES, retry_delay=RETRY_DELAY, backoff=BACKOFF,
+                 local_ttl=LOCAL_TTL, clock=time.time):
+        self.backend = backend
+        self.cache = LRUCache(clock=clock) if cache is None else cache
+        self.clock = clock
+        self.local_ttl = local_ttl
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.backoff = backoff
+        self.unavailable_until = 0
+
+    def call(self, method, *args):
+        for attempt in range(self.retries):
+            try:
+                return getattr(self.backend, method)(*args)
+            except StoreError as e:
+                logging.info('Store %s failed (attempt %d of %d): %s' % (method, attempt + 1, self.retries, e))
+                if attempt + 1 < self.retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        raise StoreError('Store is unavailable')
+
+    def get(self, key):
+        if self.backend is None:
+            raise StoreError('Store has no backend')
+        return self.call('get', key)
+
+    def cache_get(self, key):
+        value = self.cache.get(key)
+        if value is not None or self.backend is None or self.unavailable_until > self.clock():
+            return value
+        try:
+            value = self.call('get', key)
+        except StoreError:
+            self.unavailable_until = self.clock() + self.backoff
+            return None
+        if value is not None:
+            self.cache.set(key, value, self.local_ttl)
+        return value
+
+    def cache_set(self, key, value, ttl=CACHE_TTL):
+        self.cache.set(key, value, min(ttl, self.local_ttl) if self.backend is not None else ttl)
+        if self.backend is None or self.unavailable_until > self.clock():
+            return
+        try:
+            self.call('set', key, value, ttl)
+        except StoreError:
+            self.unavailable_until = self.clock() + self.backoff
@@ -1,9 +1,15 @@
 import hashlib
 import datetime
 import functools
+import httplib
+import json
+import socket
+import threading
 import unittest
+import StringIO
 
 import api
+import store
 
 
 def cases(cases):
@@ -17,6 +23,14 @@ def cases(cases):
     return decorator
 
 
+def set_valid_auth(request):
+    if request.get("login") == api.ADMIN_LOGIN:
+        request["token"] = hashlib.sha512(datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).hexdigest()
+    else:
+        msg = request.get("account", "") + request.get("login", "") + api.SALT
+        request["token"] = hashlib.sha512(msg).hexdigest()
+
+
 class TestSuite(unittest.TestCase):
     def setUp(self):
         self.context = {}
@@ -26,11 +40,7 @@ class TestSuite(unittest.TestCase):
         return api.method_handler({"body": request, "headers": self.headers}, self.context)
 
     def set_valid_auth(self, request):
-        if request.get("login") == api.ADMIN_LOGIN:
-            request["token"] = hashlib.sha512(datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).hexdigest()
-        else:
-            msg = request.get("account", "") + request.get("login", "") + api.SALT
-            request["token"] = hashlib.sha512(msg).hexdigest()
+        set_valid_auth(request)
 
     def test_empty_request(self):
         _, code = self.get_response({})
@@ -65,6 +75,9 @@ class TestSuite(unittest.TestCase):
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": "1"},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.1890"},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "XXX"},
+        {"gender": 1, "birthday": "31.02.2000"},
+        {"gender": 1, "birthday": "01.01.2000\n"},
+        {"phone": u"7917500204\u0660", "email": "stupnikov@otus.ru"},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.2000", "first_name": 1},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.2000",
          "first_name": "s", "last_name": 2},
@@ -83,6 +96,7 @@ class TestSuite(unittest.TestCase):
         {"phone": 79175002040, "email": "stupnikov@otus.ru"},
         {"gender": 1, "birthday": "01.01.2000", "first_name": "a", "last_name": "b"},
         {"gender": 0, "birthday": "01.01.2000"},
+        {"gender": 0, "birthday": "1.1.2000"},
         {"gender": 2, "birthday": "01.01.2000"},
         {"first_name": "a", "last_name": "b"},
         {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.2000",
@@ -97,6 +111,38 @@ class TestSuite(unittest.TestCase):
         self.assertTrue(isinstance(score, (int, float)) and score >= 0, arguments)
         self.assertEqual(sorted(self.context["has"]), sorted(arguments.keys()))
 
+    def test_score_cached(self):
+        s = store.Store(store.MemoryBackend())
+        scores = []
+        for arguments in ({"phone": "79175002040", "email": "a@b.ru", "gender": 1, "birthday": "01.01.2000"},
+                          {"phone": 79175002040, "email": "a@b.ru", "gender": 1, "birthday": "1.1.2000"},
+                          {"phone": 79175002040, "email": "a@b.ru", "gender": 1, "birthday": "1.1.2000",
+                           "first_name": ""}):
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+            self.set_valid_auth(request)
+            response, code = api.method_handler({"body": request, "headers": self.headers}, self.context, store=s)
+            self.assertEqual(api.OK, code, arguments)
+            scores.append(response["score"])
+            s.cache.clear()
+        self.assertEqual(1, len(set(scores)), scores)
+        self.assertEqual(1, len(s.backend.items))
+
+    @cases([
+        ({"phone": "79175002040", "email": "a@b.ru"}, {"phone": "79175002041", "email": "a@b.ru"}),
+        ({"phone": "79175002040", "email": "a@b.ru"}, {"phone": "79175002040", "email": "b@b.ru"}),
+        ({"first_name": "a", "last_name": "b"}, {"first_name": "b", "last_name": "a"}),
+        ({"first_name": u"\u0430", "last_name": "b"}, {"first_name": "a", "last_name": "b"}),
+        ({"gender": 1, "birthday": "01.01.2000"}, {"gender": 2, "birthday": "01.01.2000"}),
+        ({"gender": 1, "birthday": "01.01.2000"}, {"gender": 1, "birthday": "02.01.2000"}),
+    ])
+    def test_score_key(self, a, b):
+        keys = []
+        for arguments in (a, b):
+            request = api.OnlineScoreRequest(arguments)
+            self.assertTrue(request.is_valid(), arguments)
+            keys.append(request.get_score_key())
+        self.assertNotEqual(keys[0], keys[1])
+
     def test_ok_score_admin_request(self):
         arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
         request = {"account": "horns&hoofs", "login": "admin", "method": "online_score", "arguments": arguments}
@@ -136,5 +182,203 @@ class TestSuite(unittest.TestCase):
                         for v in response.values()))
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
+    def test_fields_order(self):
+        self.assertEqual(('account', 'login', 'token', 'arguments', 'method'), api.MethodRequest.field_names)
+        request = api.MethodRequest({"login": "h&f"})
+        self.assertFalse(request.is_valid())
+        self.assertEqual('token: Field is required., arguments: Field is required., method: Field is required.',
+                         request.error_message())
+
+
+class FailingBackend(object):
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, key, *args):
+        self.calls += 1
+        raise store.StoreError('unavailable')
+
+    set = get
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return self.now
+
+    def test_lru_cache(self):
+        cache = store.LRUCache(maxsize=2, clock=self.clock)
+        cache.set("a", "1", 10)
+        cache.set("b", "2", 20)
+        self.assertEqual("1", cache.get("a"))
+        cache.set("c", "3", 30)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(["a", "c"], list(cache.items))
+        self.now += 15
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual("3", cache.get("c"))
+        self.assertEqual(["c"], list(cache.items))
+
+    def test_memory_backend(self):
+        backend = store.MemoryBackend(clock=self.clock)
+        backend.set("a", "1", 10)
+        backend.set("b", "2")
+        self.now += 15
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual("2", backend.get("b"))
+        self.assertIsNone(backend.get("c"))
+
+    def test_cache_shared_by_backend(self):
+        backend = store.MemoryBackend(clock=self.clock)
+        first, second = store.Store(backend, clock=self.clock), store.Store(backend, clock=self.clock)
+        first.cache_set("key", "1", 600)
+        self.assertEqual("1", second.cache_get("key"))
+        backend.set("key", "2", 600)
+        self.assertEqual("1", second.cache_get("key"))
+        self.now += store.LOCAL_TTL + 1
+        self.assertEqual("2", second.cache_get("key"))
+        self.now += 600
+        self.assertIsNone(first.cache_get("key"))
+
+    def test_unavailable_backend(self):
+        backend = FailingBackend()
+        s = store.Store(backend, retries=3, retry_delay=0, clock=self.clock)
+        s.cache_set("key", "1")
+        self.assertEqual(3, backend.calls)
+        self.assertEqual("1", s.cache_get("key"))
+        self.assertIsNone(s.cache_get("other"))
+        self.assertEqual(3, backend.calls)
+        self.assertRaises(store.StoreError, s.get, "key")
+        self.assertEqual(6, backend.calls)
+        self.now += store.BACKOFF + 1
+        self.assertIsNone(s.cache_get("other"))
+        self.assertEqual(9, backend.calls)
+
+    def test_score_degrades_to_compute(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "a@b.ru"}}
+        set_valid_auth(request)
+        s = store.Store(FailingBackend(), retry_delay=0)
+        response, code = api.method_handler({"body": request, "headers": {}}, {}, store=s)
+        self.assertEqual(api.OK, code)
+        self.assertTrue(response["score"] >= 0)
+
+    def test_malformed_score(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "a@b.ru"}}
+        set_valid_auth(request)
+        s = store.Store(store.MemoryBackend())
+        score_request = api.OnlineScoreRequest(request["arguments"])
+        self.assertTrue(score_request.is_valid())
+        s.cache_set(score_request.get_score_key(), "{not json")
+        response, code = api.method_handler({"body": request, "headers": {}}, {}, store=s)
+        self.assertEqual(api.OK, code)
+        self.assertTrue(response["score"] >= 0)
+
+    def test_redis_protocol(self):
+        self.assertEqual("*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$2\r\n\xd0\xb0\r\n",
+                         store.RedisBackend.encode(("SET", "k", u"\u0430")))
+        read = lambda reply: store.RedisBackend.read_reply(StringIO.StringIO(reply))
+        self.assertEqual("OK", read("+OK\r\n"))
+        self.assertEqual("a\r\nb", read("$4\r\na\r\nb\r\n"))
+        self.assertIsNone(read("$-1\r\n"))
+        self.assertRaises(store.StoreError, read, "-ERR wrong\r\n")
+        self.assertRaises(store.StoreError, read, "$4\r\nab")
+        self.assertRaises(store.StoreError, read, "")
+        self.assertRaises(store.StoreError, read, "$abc\r\n")
+
+    def test_redis_malformed_reply(self):
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        sock.listen(1)
+
+        def reply():
+            connection, _ = sock.accept()
+            connection.recv(1024)
+            connection.sendall("$abc\r\n$1\r\nx\r\n")
+            connection.close()
+        thread = threading.Thread(target=reply)
+        thread.start()
+        backend = store.RedisBackend(*sock.getsockname())
+        self.assertRaises(store.StoreError, backend.get, "key")
+        self.assertIsNone(backend.local.connection)
+        thread.join()
+        sock.close()
+
+    def test_redis_unavailable(self):
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        backend = store.RedisBackend(*sock.getsockname())
+        sock.close()
+        self.assertRaises(store.StoreError, backend.get, "key")
+
+
+class QuietHandler(api.MainHTTPHandler):
+    store = store.Store(store.MemoryBackend())
+    router = {
+        "method": functools.partial(api.method_handler, store=store)
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestServer(unittest.TestCase):
+    def start_server(self, mode):
+        server = api.SERVERS[mode](("localhost", 0), QuietHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        return server, thread
+
+    def stop_server(self, server, thread):
+        server.stop()
+        thread.join(10)
+        server.close()
+        self.assertFalse(thread.is_alive())
+
+    def post(self, connection, body):
+        connection.request("POST", "/method/", body)
+        response = connection.getresponse()
+        return response, json.loads(response.read())
+
+    @cases(sorted(api.SERVERS))
+    def test_keep_alive(self, mode):
+        server, thread = self.start_server(mode)
+        try:
+            connection = httplib.HTTPConnection(*server.server_address)
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                       "arguments": {"gender": 1, "birthday": "01.01.2000"}}
+            set_valid_auth(request)
+            for _ in range(3):
+                response, r = self.post(connection, json.dumps(request))
+                self.assertEqual(api.OK, r["code"])
+                self.assertIn("score", r["response"])
+            self.assertEqual(1, len(QuietHandler.store.backend.items))
+            sock = connection.sock
+            response, r = self.post(connection, json.dumps(dict(request, method="")))
+            self.assertEqual(api.INVALID_REQUEST, r["code"])
+            self.assertIs(sock, connection.sock)
+            response, r = self.post(connection, "not json")
+            self.assertEqual(api.BAD_REQUEST, r["code"])
+            self.assertEqual("close", response.getheader("Connection"))
+            connection.close()
+        finally:
+            self.stop_server(server, thread)
+
+    @cases(sorted(api.SERVERS))
+    def test_graceful_stop(self, mode):
+        server, thread = self.start_server(mode)
+        address = server.server_address
+        connection = httplib.HTTPConnection(*address)
+        try:
+            response, r = self.post(connection, "{}")
+            self.assertEqual(api.OK, r["code"])
+        finally:
+            self.stop_server(server, thread)
+        self.assertRaises((socket.error, httplib.HTTPException), self.post, connection, "{}")
+        self.assertRaises(socket.error, socket.create_connection, address)
+
 if __name__ == "__main__":
     unittest.main()